@@ -1,12 +1,16 @@
 # apps/gui.py
 from __future__ import annotations
 
+import bisect
 import json
 import os
 import sys
 import threading
 import queue
+import time
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Any
 
 # src を import path に追加
 sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
@@ -16,7 +20,9 @@ import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 
 from hypermill_nctools_inventory_exporter.core import (
-    get_nctools_folder_paths,
+    FolderColumns,
+    db_cache_key,
+    get_nctools_folder_columns,
     export_nc_tool_list_for_folder_path,
     export_all_nctools_to_excel_fast,
     export_all_nctools_to_excel_by_sheet,
@@ -60,11 +66,101 @@ def _save_config(cfg: dict) -> None:
         pass
 
 
+@dataclass(frozen=True)
+class ExportContext:
+    """
+    出力ボタン押下時点の DB / 出力先（解決済み）のスナップショット。
+    worker はこれだけを参照する。
+    """
+    db_path: Path
+    out_dir: Path
+
+
+# ------------------------------------------------------------
+# Folder list cache (process lifetime)
+# ------------------------------------------------------------
+
+# key: db_cache_key(db_path)（パス + 本体と -wal の mtime/サイズ） -> (folders, all_paths)
+# mtime をキーに含めるので、DBが更新されていれば（WAL へのコミットも含めて）自動的に読み直しになる
+_FOLDER_CACHE: dict[tuple[str, int, int, int], tuple[FolderColumns, list[str]]] = {}
+
+
+def _folder_cache_key(db_path: Path) -> tuple[str, int, int, int]:
+    return db_cache_key(db_path)
+
+
+def _load_folders(db_path: Path) -> tuple[FolderColumns, list[str]]:
+    """
+    DBからフォルダ一覧を読む（キャッシュに触らないので別スレッドから呼んでよい）。
+    """
+    folders = get_nctools_folder_columns(db_path)
+    return folders, folders.paths
+
+
+def _store_folder_cache(key: tuple[str, int, int, int], loaded: tuple[FolderColumns, list[str]]) -> None:
+    """
+    _FOLDER_CACHE に登録する。Tk スレッドからだけ呼ぶこと。
+    """
+    # 同じDBの古い mtime のエントリは捨てる
+    for k in [k for k in _FOLDER_CACHE if k[0] == key[0]]:
+        del _FOLDER_CACHE[k]
+    _FOLDER_CACHE[key] = loaded
+
+
+def _load_folders_cached(db_path: Path) -> tuple[FolderColumns, list[str]]:
+    """
+    キャッシュ付きのフォルダ一覧読込。Tk スレッドからだけ呼ぶこと。
+    """
+    key = _folder_cache_key(db_path)
+    hit = _FOLDER_CACHE.get(key)
+    if hit is not None:
+        return hit
+
+    loaded = _load_folders(db_path)
+    _store_folder_cache(key, loaded)
+    return loaded
+
+
+# ------------------------------------------------------------
+# Search index
+# ------------------------------------------------------------
+
+NGRAM_N = 3
+
+
+def _build_ngram_index(paths_lower: list[str], n: int = NGRAM_N) -> dict[str, set[int]]:
+    """
+    小文字化済みパスの n-gram -> index 集合 の転置インデックスを作る。
+    """
+    index: dict[str, set[int]] = {}
+    for i, p in enumerate(paths_lower):
+        for j in range(len(p) - n + 1):
+            index.setdefault(p[j : j + n], set()).add(i)
+    return index
+
+
+def _ngram_candidates(index: dict[str, set[int]], key: str, n: int = NGRAM_N) -> list[int]:
+    """
+    key の n-gram をすべて含むパスの index を昇順で返す（部分一致の候補。最終確認は呼び出し側）。
+    """
+    grams = {key[j : j + n] for j in range(len(key) - n + 1)}
+    postings = sorted((index.get(g, set()) for g in grams), key=len)
+    if not postings or not postings[0]:
+        return []
+    ids = set(postings[0])
+    for other in postings[1:]:
+        ids &= other
+        if not ids:
+            return []
+    return sorted(ids)
+
+
+# ファイル名に使えない文字 -> "_"
+_INVALID_TABLE = str.maketrans({c: "_" for c in '<>:"/\\|?*'})
+
+
 def sanitize_filename(name: str) -> str:
-    invalid = '<>:"/\\|?*'
-    for ch in invalid:
-        name = name.replace(ch, "_")
-    name = name.rstrip(". ").strip()
+    name = name.translate(_INVALID_TABLE).rstrip(". ").strip()
     return name or "output"
 
 
@@ -78,8 +174,9 @@ def main() -> int:
     default_out_dir = Path(env_out).resolve().parent
 
     # config.json（最後に使ったDB）
-    cfg = _load_config()
-    last_db = str(cfg.get("last_db_path", "")).strip()
+    # 起動時に1回だけ読み、以降はメモリ上の dict を使う
+    _config_cache = _load_config()
+    last_db = str(_config_cache.get("last_db_path", "")).strip()
 
     # 起動時DBの初期値優先順位:
     # 1) config.json（最後に使ったDB）
@@ -108,8 +205,10 @@ def main() -> int:
 
     ttk.Label(frm_mid, text="ncTools フォルダ（Path）").pack(anchor="w")
 
-    listbox = tk.Listbox(frm_mid, height=22)
-    listbox.pack(fill="both", expand=True)
+    # 全件を1回だけ insert し、絞り込みは detach / 再 attach で表示を切り替える
+    # iid は all_paths の index（文字列）
+    tree = ttk.Treeview(frm_mid, height=22, show="tree", selectmode="browse")
+    tree.pack(fill="both", expand=True)
 
     # --- 下：出力先 / DB指定 / 実行ボタン ---
     frm_bottom = ttk.Frame(root, padding=10)
@@ -159,33 +258,98 @@ def main() -> int:
     lbl.grid(row=4, column=0, columnspan=3, sticky="w", pady=(6, 0))
 
     # Queue for worker -> UI
-    q: queue.Queue[tuple[str, int, int, str]] = queue.Queue()
+    # (kind, done, total, msg)
+    # "folders_loaded" / "folders_error" のときは done に読込の世代番号、
+    # msg に (キャッシュキー, (folders, all_paths)) / エラー文字列が入る
+    # 上限を付けておき、producer 側の暴走はメモリを食い潰す前に詰まりとして表に出す
+    q: queue.Queue[tuple[str, int, int, Any]] = queue.Queue(maxsize=1024)
     busy = {"flag": False}
+    # フォルダ一覧の読込世代。読み込み直すたびに進め、古い世代の結果は捨てる
+    folder_gen = {"n": 0}
 
     def set_busy(on: bool) -> None:
         busy["flag"] = on
 
     def pump_queue() -> None:
+        # 完了/エラーのダイアログはキューを吐き切った後に最大1つだけ出す
+        # （モーダル表示中にキューの処理が止まったり、ダイアログが重なったりしないように）
+        dialog: tuple | None = None
         try:
-            while True:
+            # 1回の tick で処理する件数に上限を設けて UI を止めない。
+            # ただしダイアログを出すことが決まったら、上限に関係なく job_end かキューが空になるまで処理する
+            # （後ろに残った進捗・状態表示がダイアログ表示後に反映されて、古い表示と並ばないように）
+            n = 0
+            while n < 64 or dialog is not None:
                 kind, done, total, msg = q.get_nowait()
-                if kind == "progress":
-                    status_var.set(msg)
+                n += 1
+                if kind == "job_start":
+                    # total はジョブ中は変わらないので maximum はここで1回だけ設定する
                     prog["maximum"] = max(1, total)
+                    prog["value"] = 0
+                    status_var.set(msg)
+                elif kind == "progress":
+                    status_var.set(msg)
                     prog["value"] = done
-                elif kind == "done":
+                elif kind == "job_end":
                     set_busy(False)
+                    if dialog is not None:
+                        break
+                elif kind == "folders_loaded":
+                    if done != folder_gen["n"]:
+                        # その後に手動で読み込み直している（遅れて届いた結果で上書きしない）
+                        continue
+                    prog.stop()
+                    prog.configure(mode="determinate", value=0)
+                    # キャッシュの更新は Tk スレッドで行う
+                    key, loaded = msg
+                    _store_folder_cache(key, loaded)
+                    _apply_folder_list(*loaded)
+                    status_var.set("待機中")
+                elif kind == "folders_error":
+                    if done != folder_gen["n"]:
+                        continue
+                    prog.stop()
+                    prog.configure(mode="determinate", value=0)
+                    status_var.set("DB読込エラー（ToolDBを選び直してください）")
+                    dialog = (messagebox.showerror, "DB読込エラー", msg)
+                elif kind == "done":
                     status_var.set("完了")
-                    messagebox.showinfo("完了", msg)
+                    # エラーが先に来ていればそちらを優先する
+                    if dialog is None or dialog[0] is messagebox.showinfo:
+                        dialog = (messagebox.showinfo, "完了", msg)
                 elif kind == "error":
-                    set_busy(False)
                     status_var.set("エラー")
-                    messagebox.showerror("エラー", msg)
+                    dialog = (messagebox.showerror, "エラー", msg)
         except queue.Empty:
             pass
-        root.after(100, pump_queue)
-
-    root.after(100, pump_queue)
+        if dialog is not None:
+            show, title, text = dialog
+            root.after(0, lambda: show(title, text))
+        # 実行中だけ細かくポーリングし、待機中は起床回数を減らす
+        root.after(50 if busy["flag"] else 250, pump_queue)
+
+    root.after(250, pump_queue)
+
+    def make_progress_cb(min_interval: float = 0.1):
+        """
+        worker -> UI の進捗通知を間引くコールバックを作る。
+        前回通知から min_interval 秒経過したか、done が total の 0.5% 以上進んだか、
+        完了（done == total）の時だけ q に積む。export_all_* に渡すシグネチャは変えない。
+        """
+        last = {"done": -1, "t": 0.0, "total": None}
+
+        def progress(done: int, total: int, msg: str) -> None:
+            if total != last["total"]:
+                # 最初の通知（total が決まった時点）でジョブ開始を知らせる
+                last["total"] = total
+                q.put(("job_start", 0, total, msg))
+            now = time.monotonic()
+            step = max(1, total // 200)
+            if done >= total or done - last["done"] >= step or now - last["t"] >= min_interval:
+                last["done"], last["t"] = done, now
+                q.put(("progress", done, total, msg))
+
+        return progress
 
     def _validate_db_path(p: Path) -> bool:
         if not p:
@@ -200,47 +364,194 @@ def main() -> int:
         # 拡張子チェックは任意（.dbじゃない場合もあるので厳密にはしない）
         return True
 
-    def _get_db_path_or_show_error() -> Path | None:
-        p = Path(db_path_var.get()).expanduser()
+    # 入力欄の resolve 結果キャッシュ（入力が変わった時だけ捨てて、次の使用時に1回だけ resolve）
+    _resolved: dict[str, Path | None] = {"db": None, "out": None}
+
+    def _resolve_entry_path(text: str) -> Path:
+        p = Path(text).expanduser()
         try:
-            p = p.resolve()
+            return p.resolve()
         except Exception:
             # resolveできないケースでもexistsは見れるのでそのまま
-            pass
+            return p
+
+    def _resolved_db_path() -> Path:
+        if _resolved["db"] is None:
+            _resolved["db"] = _resolve_entry_path(db_path_var.get())
+        return _resolved["db"]
+
+    def _resolved_out_dir() -> Path:
+        if _resolved["out"] is None:
+            _resolved["out"] = _resolve_entry_path(out_dir_var.get())
+        return _resolved["out"]
+
+    db_path_var.trace_add("write", lambda *args: _resolved.update(db=None))
+    out_dir_var.trace_add("write", lambda *args: _resolved.update(out=None))
+
+    def _get_db_path_or_show_error() -> Path | None:
+        p = _resolved_db_path()
 
         if not _validate_db_path(p):
             return None
 
-        # 最後に使ったDBを保存
-        cfg = _load_config()
-        cfg["last_db_path"] = str(p)
-        _save_config(cfg)
+        # 最後に使ったDBを保存（変わった時だけ書き込む）
+        if _config_cache.get("last_db_path") != str(p):
+            _config_cache["last_db_path"] = str(p)
+            _save_config(_config_cache)
         return p
 
+    def _snapshot_paths() -> ExportContext | None:
+        db_path = _get_db_path_or_show_error()
+        if db_path is None:
+            return None
+        return ExportContext(db_path=db_path, out_dir=_resolved_out_dir())
+
     # 起動時：DBが有効ならフォルダ一覧をロード
-    folders: list[dict] = []
+    folders: FolderColumns | None = None
     all_paths: list[str] = []
 
+    # 小文字化済みのパス（大文字小文字を無視した検索用。DB読込時に1回だけ作る）
+    all_paths_lower: list[str] = []
+    ngram_index: dict[str, set[int]] = {}
+
+    # 直前の絞り込み結果（all_paths の index。文字を追加入力した場合はここから絞り込む）
+    last_key = ""
+    last_ids: list[int] = []
+
+    # Treeview に登録済みの iid（detach 中のものも含む）
+    all_iids: list[str] = []
+
+    # 現在表示中の ids（結果が変わらない時は Treeview に触らない）
+    displayed_ids: list[int] | None = None
+
     def _reload_folder_list(db_path: Path) -> None:
-        nonlocal folders, all_paths
-        folders = get_nctools_folder_paths(db_path)
-        all_paths = [f["path"] for f in folders]
+        # 起動時の読込がまだ終わっていなくても、こちらを最新とする
+        folder_gen["n"] += 1
+        try:
+            _apply_folder_list(*_load_folders_cached(db_path))
+        finally:
+            # 起動時の読込中スピナーは、古い結果が捨てられても止まるようにここで止める
+            if str(prog.cget("mode")) == "indeterminate":
+                prog.stop()
+                prog.configure(mode="determinate", value=0)
+
+    def _apply_folder_list(folders_: FolderColumns, all_paths_: list[str]) -> None:
+        nonlocal folders, all_paths, all_paths_lower, ngram_index, last_key, last_ids, all_iids, displayed_ids
+        folders, all_paths = folders_, all_paths_
+        all_paths_lower = [p.lower() for p in all_paths]
+        ngram_index = _build_ngram_index(all_paths_lower)
+        last_key, last_ids = "", []
+
+        if all_iids:
+            tree.delete(*all_iids)
+        all_iids = [str(i) for i in range(len(all_paths))]
+        displayed_ids = None
+        for iid, p in zip(all_iids, all_paths):
+            tree.insert("", "end", iid=iid, text=p)
         refresh_list()
 
+    # refresh_list 実行中の再入（trace 経由の連鎖呼び出し）を防ぐ
+    _refreshing = {"flag": False}
+
     def refresh_list() -> None:
-        listbox.delete(0, tk.END)
-        key = filter_var.get().strip()
-        items = all_paths if not key else [p for p in all_paths if key in p]
-        for p in items:
-            listbox.insert(tk.END, p)
+        if _refreshing["flag"]:
+            return
+        _refreshing["flag"] = True
+        try:
+            _refresh_list_now()
+        finally:
+            _refreshing["flag"] = False
+
+    def _refresh_list_now() -> None:
+        nonlocal last_key, last_ids, displayed_ids
+        key = filter_var.get().strip().lower()
+        if not key:
+            ids = list(range(len(all_paths)))
+        else:
+            if last_key and key.startswith(last_key):
+                # "fo" -> "foo" のような追記なら前回結果の部分集合になる
+                source = last_ids
+            elif len(key) >= NGRAM_N:
+                # 3文字以上は転置インデックスで候補を絞ってから確認する
+                source = _ngram_candidates(ngram_index, key)
+            else:
+                source = range(len(all_paths))
+            ids = [i for i in source if key in all_paths_lower[i]]
+
+        last_key, last_ids = key, ids
+
+        # 絞り込み結果が表示中と同じなら何もしない（末尾スペース追加など）
+        # list 同士の比較は長さ違いで即 False になるので安い
+        if ids == displayed_ids:
+            return
+
+        # 再構築前の選択と表示先頭行を覚えておく
+        sel = tree.selection()
+        top_iid = tree.identify_row(1)
+
+        # 表示する iid だけを並べ直す（それ以外は detach されるだけで削除しない）
+        tree.set_children("", *(all_iids[i] for i in ids))
+
+        # 非表示になった項目が選択に残らないようにする
+        visible = set(ids)
+        hidden_sel = [iid for iid in sel if int(iid) not in visible]
+        if hidden_sel:
+            tree.selection_remove(*hidden_sel)
+
+        # ids は昇順なので、元の先頭行（無ければその次の行）の新しい位置を二分探索で求める
+        if ids and top_iid:
+            pos = bisect.bisect_left(ids, int(top_iid))
+            tree.yview_moveto(pos / len(ids))
+        kept_sel = [iid for iid in sel if int(iid) in visible]
+        if kept_sel:
+            tree.see(kept_sel[0])
+        displayed_ids = ids
+
+    # 連続入力はまとめて 1 回だけ再描画する（キー入力ごとの全件再構築を避ける）
+    _pending = {"id": None}
+
+    def _cancel_pending_refresh() -> None:
+        if _pending["id"] is not None:
+            root.after_cancel(_pending["id"])
+            _pending["id"] = None
+
+    def schedule_refresh(*_args) -> None:
+        # trace からは予約するだけで、同期的には refresh_list を呼ばない
+        _cancel_pending_refresh()
+        _pending["id"] = root.after(150, _run_pending_refresh)
+
+    def _run_pending_refresh() -> None:
+        _pending["id"] = None
+        refresh_list()
+
+    filter_var.trace_add("write", schedule_refresh)
+
+    def set_filter(text: str) -> None:
+        """
+        プログラムから検索文字列を変える場合は必ずこれを使う。
+        trace で予約された再描画を取り消して、1回だけ即時に再描画する。
+        """
+        filter_var.set(text)
+        _cancel_pending_refresh()
+        refresh_list()
 
-    filter_var.trace_add("write", lambda *args: refresh_list())
+    # 起動時の自動復元（DB読込は別スレッドで行い、ウィンドウは先に表示する）
+    # 別スレッドではキャッシュに触らず、読んだ結果をキュー経由で Tk スレッドに返す
+    def _load_initial_folders(db_path: Path, gen: int) -> None:
+        try:
+            key = _folder_cache_key(db_path)
+            q.put(("folders_loaded", gen, 0, (key, _load_folders(db_path))))
+        except Exception as e:
+            q.put(("folders_error", gen, 0, str(e)))
 
-    # 起動時の自動復元
     try:
         p0 = Path(initial_db).expanduser() if initial_db else None
         if p0 and p0.exists() and p0.is_file():
-            _reload_folder_list(p0)
+            status_var.set("DB読込中...")
+            prog.configure(mode="indeterminate")
+            prog.start(50)
+            folder_gen["n"] += 1
+            threading.Thread(target=_load_initial_folders, args=(p0, folder_gen["n"]), daemon=True).start()
         else:
             # DBが未設定/無効でもGUIは起動させる
             status_var.set("ToolDB を指定してください（参照ボタン）")
@@ -276,72 +587,72 @@ def main() -> int:
 
     # --- 選択フォルダ出力 ---
     def do_export_selected() -> None:
-        db_path = _get_db_path_or_show_error()
-        if db_path is None:
+        ctx = _snapshot_paths()
+        if ctx is None:
             return
 
-        sel = listbox.curselection()
+        sel = tree.selection()
         if not sel:
             messagebox.showwarning("未選択", "ncTools フォルダを選択してください")
             return
-        nctools_folder_path = listbox.get(sel[0])
+        nctools_folder_path = all_paths[int(sel[0])]
 
-        base_out_dir = Path(out_dir_var.get()).expanduser().resolve()
         safe = sanitize_filename(nctools_folder_path)
-        out_folder = base_out_dir / safe
-        out_folder.mkdir(parents=True, exist_ok=True)
-        out_xlsx = out_folder / f"nctools_list__{safe}.xlsx"
+        out_xlsx = ctx.out_dir / safe / f"nctools_list__{safe}.xlsx"
 
         def worker():
             try:
-                q.put(("progress", 0, 2, "選択フォルダを出力中..."))
-                export_nc_tool_list_for_folder_path(db_path, nctools_folder_path, out_xlsx)
+                q.put(("job_start", 0, 2, "選択フォルダを出力中..."))
+                out_xlsx.parent.mkdir(parents=True, exist_ok=True)
+                export_nc_tool_list_for_folder_path(ctx.db_path, nctools_folder_path, out_xlsx)
                 q.put(("progress", 2, 2, "完了"))
                 q.put(("done", 2, 2, f"出力しました:\n{out_xlsx}"))
             except Exception as e:
                 q.put(("error", 0, 1, str(e)))
+            finally:
+                q.put(("job_end", 0, 0, ""))
 
         run_in_thread(worker)
 
     # --- 全件高速（1ファイル） ---
     def do_export_all_fast() -> None:
-        db_path = _get_db_path_or_show_error()
-        if db_path is None:
+        ctx = _snapshot_paths()
+        if ctx is None:
             return
 
-        base_out_dir = Path(out_dir_var.get()).expanduser().resolve()
-        out_xlsx = base_out_dir / "all_nctools_inventory_fast.xlsx"
+        out_xlsx = ctx.out_dir / "all_nctools_inventory_fast.xlsx"
 
         def worker():
             try:
-                def progress(done: int, total: int, msg: str) -> None:
-                    q.put(("progress", done, total, msg))
+                progress = make_progress_cb()
 
-                export_all_nctools_to_excel_fast(db_path, out_xlsx, progress=progress)
+                export_all_nctools_to_excel_fast(ctx.db_path, out_xlsx, progress=progress)
                 q.put(("done", 1, 1, f"出力しました:\n{out_xlsx}"))
             except Exception as e:
                 q.put(("error", 0, 1, str(e)))
+            finally:
+                q.put(("job_end", 0, 0, ""))
 
         run_in_thread(worker)
 
     # --- 全件（フォルダ別シート） ---
     def do_export_all_by_sheet() -> None:
-        db_path = _get_db_path_or_show_error()
-        if db_path is None:
+        ctx = _snapshot_paths()
+        if ctx is None:
             return
 
-        base_out_dir = Path(out_dir_var.get()).expanduser().resolve()
-        out_xlsx = base_out_dir / "all_nctools_inventory_by_sheet.xlsx"
+        out_xlsx = ctx.out_dir / "all_nctools_inventory_by_sheet.xlsx"
 
         def worker():
             try:
-                def progress(done: int, total: int, msg: str) -> None:
-                    q.put(("progress", done, total, msg))
+                progress = make_progress_cb()
 
-                export_all_nctools_to_excel_by_sheet(db_path, out_xlsx, progress=progress)
+                export_all_nctools_to_excel_by_sheet(ctx.db_path, out_xlsx, progress=progress)
                 q.put(("done", 1, 1, f"出力しました:\n{out_xlsx}"))
             except Exception as e:
                 q.put(("error", 0, 1, str(e)))
+            finally:
+                q.put(("job_end", 0, 0, ""))
 
         run_in_thread(worker)
 
@@ -355,6 +666,12 @@ def main() -> int:
         row=7, column=0, columnspan=3, pady=(6, 0), sticky="we"
     )
 
+    def on_close() -> None:
+        _save_config(_config_cache)
+        root.destroy()
+
+    root.protocol("WM_DELETE_WINDOW", on_close)
+
     root.mainloop()
     return 0
 
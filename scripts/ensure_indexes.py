@@ -0,0 +1,53 @@
+# scripts/ensure_indexes.py
+# 読み取りクエリ用の索引が無ければ作成する（DBに書き込むので、バックアップを取ってから実行する）
+# Usage:
+#   python .\scripts\ensure_indexes.py --db "D:\...\NC_Tool_log.db" [--dry-run]
+from __future__ import annotations
+
+import argparse
+import sqlite3
+from pathlib import Path
+
+# scripts/ 直下から実行されても src/ がimportできるように
+import sys
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from hypermill_nctools_inventory_exporter.db import (
+    connect_readonly,
+    ensure_read_indexes,
+    missing_read_indexes,
+)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Create indexes used by the exporter's read queries")
+    ap.add_argument("--db", required=True, type=Path, help="SQLite DB path (NC_Tool_log.db)")
+    ap.add_argument("--dry-run", action="store_true", help="only list missing indexes")
+    args = ap.parse_args()
+
+    conn = connect_readonly(args.db)
+    try:
+        missing = missing_read_indexes(conn)
+    finally:
+        conn.close()
+
+    if not missing:
+        print("[OK] all indexes present")
+        return 0
+
+    for name, table, cols in missing:
+        print(f"[missing] {name} ON {table}({', '.join(cols)})")
+    if args.dry_run:
+        return 0
+
+    try:
+        created = ensure_read_indexes(args.db)
+    except sqlite3.Error as e:
+        print(f"[ERROR] could not create indexes: {e}")
+        return 1
+    print(f"[OK] created: {', '.join(created)}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
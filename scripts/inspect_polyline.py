@@ -2,9 +2,12 @@
 from __future__ import annotations
 
 import argparse
+from collections import Counter
 from pathlib import Path
 from dataclasses import dataclass
 
+import numpy as np
+
 # scripts/ 直下から実行されても src/ がimportできるように
 import sys
 sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
@@ -15,7 +18,10 @@ from hypermill_nctools_inventory_exporter.geometry_polyline import (
     hexdump,
     iter_geometry_ids_with_polyline,
     parse_polyline,
+    polyline_columns,
     read_geometry_polyline_blob,
+    read_geometry_polyline_blobs,
+    simplify_polyline_rdp,
     summarize_record_types,
 )
 
@@ -32,36 +38,37 @@ def cmd_summary(db_path: Path, sample_n: int, header: int | None, record_len: in
     if header is not None and record_len is not None:
         fmt_fixed = PolylineFormat(header, record_len)
 
-    global_counts: dict[int, int] = {}
-    fmt_used_counts: dict[tuple[int, int], int] = {}
-
-    for gid in gids[:sample_n]:
-        blob = read_geometry_polyline_blob(db_path, gid)
+    # u16 の種別コードごとの件数（bincount で C 側で集計する）
+    global_counts = np.zeros(1 << 16, dtype=np.int64)
+    fmt_used_counts: Counter[tuple[int, int]] = Counter()
 
+    # 接続は1回だけ開いて使い回す
+    for gid, blob in read_geometry_polyline_blobs(db_path, gids[:sample_n]):
         fmt = fmt_fixed or guess_polyline_format(blob)
         if fmt is None:
             print(f"[skip] geometry_id={gid}: format not guessed")
             continue
 
-        fmt_used_counts[(fmt.header_len, fmt.record_len)] = fmt_used_counts.get((fmt.header_len, fmt.record_len), 0) + 1
+        fmt_used_counts[(fmt.header_len, fmt.record_len)] += 1
 
+        # 種別列だけを NumPy で取り出す（レコードごとのオブジェクトは作らない）
         try:
-            _, recs = parse_polyline(blob, fmt)
+            types, _ = polyline_columns(blob, fmt)
         except Exception as e:
             print(f"[skip] geometry_id={gid}: parse failed: {e}")
             continue
 
-        counts = summarize_record_types(recs)
-        for k, v in counts.items():
-            global_counts[k] = global_counts.get(k, 0) + v
+        global_counts += np.bincount(types, minlength=global_counts.size)
 
     print("=== Format usage (header_len, record_len) ===")
-    for (h, r), c in sorted(fmt_used_counts.items(), key=lambda kv: -kv[1]):
+    for (h, r), c in fmt_used_counts.most_common():
         print(f"  ({h}, {r}) : {c}")
 
     print("\n=== Record type global counts (u16) ===")
-    for t, c in sorted(global_counts.items(), key=lambda kv: (-kv[1], kv[0])):
-        print(f"  {t:>6} : {c}")
+    used = np.flatnonzero(global_counts)
+    # 件数の降順、同数なら種別コードの昇順
+    for t in used[np.lexsort((used, -global_counts[used]))]:
+        print(f"  {int(t):>6} : {int(global_counts[t])}")
 
     return 0
 
@@ -133,29 +140,40 @@ def cmd_dump(db_path: Path, geometry_id: int, header: int | None, record_len: in
     return 0
 
 
+# これより点数が多い場合は頂点マーカーを描かない（--annotate 指定時は除く）
+_MAX_VERTEX_DOTS = 100
+# --annotate の番号ラベルはこの個数を上限に間引く
+_MAX_LABELS = 200
+
+
 def _extract_points_f64_be(
-    recs,
+    rec_types: np.ndarray,
+    payloads: np.ndarray,
     only_type: int | None,
     stop_at_zero: bool,
     max_points: int | None,
-) -> list[tuple[float, float, float]]:
-    pts: list[tuple[float, float, float]] = []
-    for r in recs:
-        if only_type is not None and r.rec_type_u16 != only_type:
-            continue
-        if len(r.f64_be) < 2:
-            continue
-
-        x = float(r.f64_be[0])
-        y = float(r.f64_be[1])
-        z = float(r.f64_be[2]) if len(r.f64_be) >= 3 else 0.0
-
-        if stop_at_zero and x == 0.0 and y == 0.0 and z == 0.0:
-            break
-
-        pts.append((x, y, z))
-        if max_points is not None and len(pts) >= max_points:
-            break
+) -> np.ndarray:
+    """
+    payload 先頭の f64(BE) x, y, (z) を (N, 3) 配列で返す。
+    種別で先に絞ってから対象レコードだけを f64 として解釈する。
+    """
+    nf = min(payloads.shape[1] // 8, 3)
+    if nf < 2:
+        return np.empty((0, 3))
+
+    sel = payloads if only_type is None else payloads[rec_types == only_type]
+    # BE のままバイト列として集めてから、まとめて byteswap してネイティブ順に読み替える
+    be = np.ascontiguousarray(sel[:, : nf * 8]).view(">f8")
+    vals = be.byteswap().view(be.dtype.newbyteorder())
+    pts = np.zeros((len(vals), 3))
+    pts[:, :nf] = vals
+
+    if stop_at_zero:
+        zero = (pts == 0.0).all(axis=1)
+        if zero.any():
+            pts = pts[: int(zero.argmax())]
+    if max_points is not None:
+        pts = pts[:max_points]
     return pts
 
 
@@ -170,9 +188,10 @@ class ToolSimple:
     length: float
 
 
-def _safe_max_pos(*vals: float) -> float:
-    cands = [v for v in vals if isinstance(v, (int, float)) and v is not None and v > 0]
-    return max(cands) if cands else 0.0
+def _safe_max_pos(*vals: float | None) -> float:
+    arr = np.fromiter((v for v in vals if v is not None), dtype=np.float64)
+    pos = arr[arr > 0]
+    return float(pos.max()) if pos.size else 0.0
 
 
 def load_tool_simple(cur, tool_id: int) -> ToolSimple | None:
@@ -218,13 +237,12 @@ def tool_cylinder_profile(tool: ToolSimple, tip_z: float) -> list[tuple[float, f
     ]
 
 
-def mirror_profile(profile_zr: list[tuple[float, float]]) -> tuple[list[float], list[float]]:
+def mirror_profile(profile_zr: list[tuple[float, float]]) -> tuple[np.ndarray, np.ndarray]:
     # profile_zr: [(z, r), ...]   r>=0
-    z = [p[0] for p in profile_zr]
-    r = [p[1] for p in profile_zr]
+    arr = np.asarray(profile_zr, dtype=np.float64).reshape(-1, 2)
     # 上側 + 下側（反転）で閉じる
-    z2 = z + z[::-1]
-    y2 = r + [-v for v in r[::-1]]
+    z2 = np.concatenate([arr[:, 0], arr[::-1, 0]])
+    y2 = np.concatenate([arr[:, 1], -arr[::-1, 1]])
     return z2, y2
 
 
@@ -241,6 +259,22 @@ def load_nctool_basic(cur, nctool_id: int):
     return cur.fetchone()
 
 
+# NCTools のオーバーレイ用 SELECT（DBパスごとに PRAGMA table_info を1回だけ引く）
+_NCTOOL_OVERLAY_OPTIONAL_COLS = ("gage_length", "holder_reach", "tool_length")
+_NCTOOL_OVERLAY_SQL_CACHE: dict[str, str] = {}
+
+
+def _nctool_overlay_sql(cur, db_key: str) -> str:
+    sql = _NCTOOL_OVERLAY_SQL_CACHE.get(db_key)
+    if sql is None:
+        cols = {row[1] for row in cur.execute("PRAGMA table_info(NCTools)")}
+        # 存在しない列は NULL で埋めて、戻り値の形を固定する
+        exprs = [c if c in cols else f"NULL AS {c}" for c in _NCTOOL_OVERLAY_OPTIONAL_COLS]
+        sql = f"SELECT id, tool_id, {', '.join(exprs)} FROM NCTools WHERE id = ?"
+        _NCTOOL_OVERLAY_SQL_CACHE[db_key] = sql
+    return sql
+
+
 def cmd_plot(
     db_path: Path,
     geometry_id: int,
@@ -256,6 +290,8 @@ def cmd_plot(
     save: Path | None,
     nctool_id: int | None,
     tool_tip_mode: str,
+    simplify_tol: float | None = None,
+    annotate_stride: int = 10,
 ) -> int:
     """
     polyline(片側断面)を (R, Z) として解釈し、左右ミラーして断面として fill 表示。
@@ -266,20 +302,20 @@ def cmd_plot(
     """
     import sqlite3
     import matplotlib.pyplot as plt
+    from matplotlib.collections import LineCollection
+    import numpy as np
 
     # ---------------------------
     # helpers (この関数内で完結)
     # ---------------------------
-    def build_mirror_polygon(rs: list[float], zs: list[float]) -> tuple[list[float], list[float]]:
+    def build_mirror_polygon(rs: np.ndarray, zs: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
         """右側断面(rs>=0想定)を左右ミラーして閉じたポリゴン (R, Z) を返す。"""
-        rs_neg = [-r for r in rs[::-1]]
-        zs_neg = zs[::-1]
-        poly_r = rs + rs_neg
-        poly_z = zs + zs_neg
-        return poly_r, poly_z
+        r = np.asarray(rs, dtype=np.float64)
+        z = np.asarray(zs, dtype=np.float64)
+        return np.concatenate([r, -r[::-1]]), np.concatenate([z, z[::-1]])
 
     def apply_rz_transforms(R: float, Z: float) -> tuple[float, float]:
-        """swap/flip を (R,Z) に適用。geometry と tool で同じ処理を使う。"""
+        """swap/flip を (R,Z) に適用（スカラでも NumPy 配列でも可）。geometry と tool で同じ処理を使う。"""
         if swap_xy:
             Z, R = R, Z
         if flip_x:
@@ -288,17 +324,6 @@ def cmd_plot(
             Z = -Z
         return R, Z
 
-    def safe_max_pos(*vals: float) -> float:
-        cands = []
-        for v in vals:
-            try:
-                fv = float(v)
-            except Exception:
-                continue
-            if fv > 0:
-                cands.append(fv)
-        return max(cands) if cands else 0.0
-
     # tool: (z,r) 片側プロファイルを作る
     def tool_cylinder_profile_zr(dia: float, length: float, tip_z: float) -> list[tuple[float, float]]:
         r = max(dia * 0.5, 0.0)
@@ -307,40 +332,24 @@ def cmd_plot(
         z1 = tip_z
         return [(z0, 0.0), (z0, r), (z1, r), (z1, 0.0)]
 
-    def mirror_profile_zr(profile_zr: list[tuple[float, float]]) -> tuple[list[float], list[float]]:
+    def mirror_profile_zr(profile_zr: list[tuple[float, float]]) -> tuple[np.ndarray, np.ndarray]:
         """
         profile_zr: [(Z, R), ...] (R>=0)
         戻り値: polyline の X,Y に使えるよう (Rlist, Zlist) ではなく
               ここでは (Zlist, Rlist) を返す作りにしている人が多いので注意。
         この関数は「左右ミラーで閉じた輪郭線」を返す。
         """
-        zs = [p[0] for p in profile_zr]
-        rs = [p[1] for p in profile_zr]
-        zs2 = zs + zs[::-1]
-        rs2 = rs + [-v for v in rs[::-1]]
-        return zs2, rs2
+        return mirror_profile(profile_zr)
 
     # NCTools から tool_id / gage_length / holder_reach / tool_length を取る（列が無いDBも想定して段階的に試す）
     def load_nctool_overlay_info(cur, nctool_id_: int):
-        # まずは列が多い版（あなたのDBのPRAGMA出力に holder_reach, tool_length がある想定）
-        candidates = [
-            ("SELECT id, tool_id, gage_length, holder_reach, tool_length FROM NCTools WHERE id = ?", 5),
-            ("SELECT id, tool_id, gage_length, holder_reach FROM NCTools WHERE id = ?", 4),
-            ("SELECT id, tool_id, gage_length FROM NCTools WHERE id = ?", 3),
-            ("SELECT id, tool_id FROM NCTools WHERE id = ?", 2),
-        ]
-        for sql, ncols in candidates:
-            try:
-                cur.execute(sql, (nctool_id_,))
-                row = cur.fetchone()
-                if row:
-                    # 足りない分は None で埋める
-                    row = tuple(row) + (None,) * (5 - len(row))
-                    (nid, tool_id, gage_len, holder_reach, tool_len) = row[:5]
-                    return nid, tool_id, gage_len, holder_reach, tool_len
-            except Exception:
-                pass
-        return None
+        cur.execute(_nctool_overlay_sql(cur, str(db_path)), (nctool_id_,))
+        row = cur.fetchone()
+        if not row:
+            return None
+        # 無い列は SELECT 側で NULL を返しているので常に5要素
+        (nid, tool_id, gage_len, holder_reach, tool_len) = row
+        return nid, tool_id, gage_len, holder_reach, tool_len
 
     # Tools から簡易形状(D, L)を推定
     def load_tool_simple_info(cur, tool_id_: int):
@@ -361,7 +370,7 @@ def cmd_plot(
             length = float(total_len or 0.0)
 
             # 直径は「それっぽい候補の最大正値」で割り切り（parametric簡易）
-            dia = safe_max_pos(p4, p1, p2)
+            dia = _safe_max_pos(p4, p1, p2)
 
             return {
                 "tool_id": int(_id),
@@ -372,88 +381,101 @@ def cmd_plot(
         except Exception:
             return None
 
-    # ---------------------------
-    # 1) polyline 読み取り & 解析
-    # ---------------------------
-    blob = read_geometry_polyline_blob(db_path, geometry_id)
-
-    fmt = PolylineFormat(header, record_len) if (header is not None and record_len is not None) else guess_polyline_format(blob)
-    if fmt is None:
-        print("[ERROR] format not guessed. try --header and --record-len")
-        return 1
-
+    # DB接続は1本だけ開いて polyline 読み取りと工具オーバーレイで共有する
+    # （hyperMILL が開いている最中でも読めるよう mode=ro のみ。immutable は付けない。
+    #   パスに空白や # があっても壊れないよう as_uri() で URI を作る）
+    conn = sqlite3.connect(f"{db_path.resolve().as_uri()}?mode=ro", uri=True)
     try:
-        _, recs = parse_polyline(blob, fmt)
-    except Exception as e:
-        print(f"[ERROR] parse failed: {e}")
-        return 1
-
-    pts = _extract_points_f64_be(recs, only_type=only_type, stop_at_zero=stop_at_zero, max_points=max_points)
-    if not pts:
-        print("[ERROR] no points extracted (check --type / header/record-len)")
-        return 1
-
-    # ---------------------------
-    # 2) (R=x, Z=y) に変換 + transform
-    # ---------------------------
-    zs: list[float] = []
-    rs: list[float] = []
-    for (x, y, _z) in pts:
-        Z = float(y)
-        R = float(x)
-        R, Z = apply_rz_transforms(R, Z)
-        rs.append(R)
-        zs.append(Z)
-
-    # 表示範囲の参考（tool tip の zmax/zmin に使う）
-    zmin, zmax = min(zs), max(zs)
-
-    # ---------------------------
-    # 3) plot geometry (mirror+fill)
-    # ---------------------------
-    fig, ax = plt.subplots()
-
-    # geometry: mirror polygon fill
-    poly_r, poly_z = build_mirror_polygon(rs, zs)
-    ax.fill(poly_r, poly_z, alpha=0.25)
-
-    # geometry outline (右/左)
-    ax.plot(rs, zs, marker="o")
-    ax.plot([-r for r in rs], zs)
-
-    # 中心線
-    ax.axvline(0.0, linewidth=1)
+        conn.execute("PRAGMA query_only=1")
+        conn.execute("PRAGMA mmap_size=268435456")
 
-    # ラベル（基本は不要なら annotate=False で消える）
-    if annotate:
-        for i, (R, Z) in enumerate(zip(rs, zs)):
-            ax.text(R, Z, str(i), fontsize=8)
+        # ---------------------------
+        # 1) polyline 読み取り & 解析
+        # ---------------------------
+        blob = read_geometry_polyline_blob(db_path, geometry_id, conn=conn)
 
-    # タイトル等
-    ttl = f"geometry_id={geometry_id} mirror+fill (header={fmt.header_len}, record={fmt.record_len}"
-    if only_type is not None:
-        ttl += f", type={only_type}"
-    ttl += ")"
-    ax.set_title(ttl)
-
-    ax.set_xlabel("R" + (" (swapped)" if swap_xy else ""))
-    ax.set_ylabel("Z" + (" (swapped)" if swap_xy else ""))
-    ax.grid(True)
-    ax.axis("equal")
+        fmt = PolylineFormat(header, record_len) if (header is not None and record_len is not None) else guess_polyline_format(blob)
+        if fmt is None:
+            print("[ERROR] format not guessed. try --header and --record-len")
+            return 1
 
-    # ---------------------------
-    # 4) tool overlay (mirror+fill)
-    # ---------------------------
-    if nctool_id is not None:
         try:
-            conn = sqlite3.connect(str(db_path))
-            cur = conn.cursor()
+            rec_types, payloads = polyline_columns(blob, fmt)
         except Exception as e:
-            print(f"[WARN] cannot open DB for tool overlay: {e}")
-            cur = None
-            conn = None
-
-        if cur is not None:
+            print(f"[ERROR] parse failed: {e}")
+            return 1
+
+        pts = _extract_points_f64_be(rec_types, payloads, only_type=only_type, stop_at_zero=stop_at_zero, max_points=max_points)
+        if len(pts) == 0:
+            print("[ERROR] no points extracted (check --type / header/record-len)")
+            return 1
+
+        # ---------------------------
+        # 2) (R=x, Z=y) に変換 + transform
+        # ---------------------------
+        # 列スライスのまま配列ごと変換する（点ごとのループは回さない）
+        rs, zs = apply_rz_transforms(pts[:, 0], pts[:, 1])
+
+        # 描画前に間引く（ピクセル以下の凹凸は描いても見えない）
+        if simplify_tol:
+            keep = simplify_polyline_rdp(rs, zs, simplify_tol)
+            rs = rs[keep]
+            zs = zs[keep]
+
+        # 表示範囲の参考（tool tip の zmax/zmin に使う）
+        zmin, zmax = float(zs.min()), float(zs.max())
+
+        # ---------------------------
+        # 3) plot geometry (mirror+fill)
+        # ---------------------------
+        fig, ax = plt.subplots()
+
+        # geometry: mirror polygon fill
+        poly_r, poly_z = build_mirror_polygon(rs, zs)
+        # 重い artist はラスタ化（svg/pdf 保存時も軸・ラベルはベクタのまま）
+        ax.fill(poly_r, poly_z, alpha=0.25, rasterized=True)
+        # 表示範囲は描いた配列から最後に1回だけ求める
+        extent_r = [poly_r]
+        extent_z = [poly_z]
+
+        # geometry outline (右/左) は1つの LineCollection にまとめて描く
+        seg_r = np.column_stack([rs, zs])
+        seg_l = seg_r * np.array([-1.0, 1.0])
+        outline = LineCollection([seg_r, seg_l], linewidths=1, colors="C1", rasterized=True)
+        ax.add_collection(outline)
+        ax.autoscale_view()
+
+        # 頂点マーカーは右側だけ、scatter（PathCollection）1個で描く
+        if annotate or len(rs) <= _MAX_VERTEX_DOTS:
+            ax.scatter(seg_r[:, 0], seg_r[:, 1], s=12, color="C1", zorder=outline.get_zorder() + 0.1, rasterized=True)
+
+        # 中心線
+        ax.axvline(0.0, linewidth=1)
+
+        # ラベル（基本は不要なら annotate=False で消える）
+        # stride 毎に1点、かつ最大 _MAX_LABELS 個まで
+        if annotate:
+            stride = max(annotate_stride, 1, -(-len(rs) // _MAX_LABELS))
+            text_kw = {"fontsize": 8}
+            for i in range(0, len(rs), stride):
+                ax.text(rs[i], zs[i], str(i), **text_kw)
+
+        # タイトル等
+        ttl = f"geometry_id={geometry_id} mirror+fill (header={fmt.header_len}, record={fmt.record_len}"
+        if only_type is not None:
+            ttl += f", type={only_type}"
+        ttl += ")"
+        ax.set_title(ttl)
+
+        ax.set_xlabel("R" + (" (swapped)" if swap_xy else ""))
+        ax.set_ylabel("Z" + (" (swapped)" if swap_xy else ""))
+        ax.grid(True)
+
+        # ---------------------------
+        # 4) tool overlay (mirror+fill)
+        # ---------------------------
+        if nctool_id is not None:
+            cur = conn.cursor()
             nct = load_nctool_overlay_info(cur, nctool_id)
             if not nct:
                 print(f"[WARN] NCTools not found (or columns missing): id={nctool_id}")
@@ -473,17 +495,15 @@ def cmd_plot(
                 tool = load_tool_simple_info(cur, int(tool_id))
                 if tool and tool["dia"] > 0 and tool["length"] > 0:
                     prof_zr = tool_cylinder_profile_zr(tool["dia"], tool["length"], tip_z=tip_z)
-                    tz, tr = mirror_profile_zr(prof_zr)  # tz:Zlist, tr:Rlist
+                    tz, tr = mirror_profile_zr(prof_zr)  # tz:Z配列, tr:R配列
 
                     # tool も同じ transform を適用してから描画（swap/flip の整合性）
-                    tr2: list[float] = []
-                    tz2: list[float] = []
-                    for (Z, R) in zip(tz, tr):
-                        R2, Z2 = apply_rz_transforms(float(R), float(Z))
-                        tr2.append(R2)
-                        tz2.append(Z2)
+                    # apply_rz_transforms は配列のままでも同じ結果になる
+                    tr2, tz2 = apply_rz_transforms(tr, tz)
 
-                    ax.fill(tr2, tz2, alpha=0.30)
+                    ax.fill(tr2, tz2, alpha=0.30, rasterized=True)
+                    extent_r.append(tr2)
+                    extent_z.append(tz2)
 
                     # ラベルは「基本いらない」運用が良さそうなので annotate の時だけ出す
                     if annotate:
@@ -498,20 +518,30 @@ def cmd_plot(
                 else:
                     print(f"[WARN] tool simple not available: tool_id={tool_id}")
 
-            if conn is not None:
-                conn.close()
-
-    # ---------------------------
-    # 5) save / show
-    # ---------------------------
-    if save is not None:
-        save.parent.mkdir(parents=True, exist_ok=True)
-        fig.savefig(save, dpi=160)
-        print(f"[OK] saved: {save}")
-    else:
-        plt.show()
-
-    return 0
+        # axis("equal") の代わりに、範囲と箱の縦横比を直接指定する
+        all_r = np.concatenate(extent_r)
+        all_z = np.concatenate(extent_z)
+        r_min, r_max = float(all_r.min()), float(all_r.max())
+        z_min, z_max = float(all_z.min()), float(all_z.max())
+        pad = 0.05 * max(r_max - r_min, z_max - z_min, 1e-9)
+        r_min, r_max, z_min, z_max = r_min - pad, r_max + pad, z_min - pad, z_max + pad
+        ax.set_xlim(r_min, r_max)
+        ax.set_ylim(z_min, z_max)
+        ax.set_box_aspect((z_max - z_min) / (r_max - r_min))
+
+        # ---------------------------
+        # 5) save / show
+        # ---------------------------
+        if save is not None:
+            save.parent.mkdir(parents=True, exist_ok=True)
+            fig.savefig(save, dpi=160)
+            print(f"[OK] saved: {save}")
+        else:
+            plt.show()
+
+        return 0
+    finally:
+        conn.close()
 
 
 
@@ -543,7 +573,9 @@ def main() -> int:
     ap_plot.add_argument("--flip-x", action="store_true", help="flip R sign")
     ap_plot.add_argument("--flip-y", action="store_true", help="flip Z sign")
     ap_plot.add_argument("--annotate", action="store_true", help="label point indices")
+    ap_plot.add_argument("--annotate-stride", type=int, default=10, help="with --annotate, label every k-th point (max 200 labels)")
     ap_plot.add_argument("--save", type=Path, default=None, help="save png to path instead of showing window")
+    ap_plot.add_argument("--simplify-tol", type=float, default=None, help="Douglas-Peucker tolerance to thin points before plotting")
 
     # 追加：NCToolから工具を簡易描画
     ap_plot.add_argument("--nctool-id", type=int, default=None, help="overlay TOOL (parametric) by nctool_id")
@@ -579,6 +611,8 @@ def main() -> int:
             save=args.save,
             nctool_id=args.nctool_id,
             tool_tip_mode=args.tool_tip,
+            simplify_tol=args.simplify_tol,
+            annotate_stride=args.annotate_stride,
         )
 
     return 1
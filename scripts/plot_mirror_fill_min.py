@@ -6,10 +6,20 @@ from __future__ import annotations
 
 import argparse
 import sqlite3
-import struct
-from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable, List, Tuple, Optional
+from typing import Tuple, Optional
+
+import numpy as np
+
+# Make src/ importable when run directly from scripts/
+import sys
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from hypermill_nctools_inventory_exporter.geometry_polyline import (
+    PolylineFormat,
+    parse_polyline_typed,
+    simplify_polyline_rdp,
+)
 
 
 # ----------------------------
@@ -64,108 +74,93 @@ def read_geometry_polyline_blob(db_path: Path, geometry_id: int) -> bytes:
 # ----------------------------
 # Polyline decode
 # ----------------------------
-@dataclass(frozen=True)
-class PolyRec:
-    idx: int
-    rec_type: int
-    payload: bytes
-
-    def f64_be_xy(self) -> Tuple[float, float]:
-        # payload: 24 bytes. Assume first 16 bytes are (x,y) float64 big-endian.
-        x = struct.unpack(">d", self.payload[0:8])[0]
-        y = struct.unpack(">d", self.payload[8:16])[0]
-        return x, y
-
-
-def iter_records(blob: bytes, header_len: int, record_len: int) -> Iterable[PolyRec]:
-    # record format (your current assumption):
-    #   u16 type (LE) + 24-byte payload  => 26 bytes total
-    # (If you later find type endian differs, flip "<H" to ">H")
-    off = header_len
-    idx = 0
-    while off + record_len <= len(blob):
-        rec = blob[off : off + record_len]
-        rec_type = struct.unpack("<H", rec[0:2])[0]
-        payload = rec[2:]
-        yield PolyRec(idx=idx, rec_type=rec_type, payload=payload)
-        idx += 1
-        off += record_len
-
-
-def extract_points_f64_be(blob: bytes, header_len: int, record_len: int, target_type: int) -> List[Tuple[float, float, int]]:
-    pts: List[Tuple[float, float, int]] = []
-    for r in iter_records(blob, header_len, record_len):
-        if r.rec_type != target_type:
-            continue
-        x, y = r.f64_be_xy()
-        pts.append((x, y, r.idx))
-    return pts
+def extract_points_f64_be(blob: bytes, header_len: int, record_len: int, target_type: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns (xy, idx): xy is (M, 2) float64 (payload[0:16] as 2x f64 BE),
+    idx is the record index of each point.
+    record format (your current assumption):
+      u16 type (LE) + 24-byte payload  => 26 bytes total
+    Only records of target_type are decoded.
+    """
+    idx, xy = parse_polyline_typed(blob, PolylineFormat(header_len, record_len), target_type)
+    return xy, idx
 
 
 # ----------------------------
 # Mirror + fill plot
 # ----------------------------
-def mirror_and_close_polygon(points: List[Tuple[float, float, int]]) -> List[Tuple[float, float]]:
+# Above this many points, vertex markers are skipped (unless --annotate)
+_MAX_VERTEX_DOTS = 100
+
+def mirror_and_close_polygon(xy: np.ndarray) -> np.ndarray:
     """
     Given right-side polyline points (x>=0 expected),
     create a closed polygon by mirroring across X=0.
+    Returns an (M, 2) array.
     """
-    if len(points) < 2:
-        return []
-
-    right = [(x, y) for x, y, _i in points]
+    if len(xy) < 2:
+        return np.empty((0, 2))
 
     # Mirror: reverse order so polygon wraps around nicely
-    left = [(-x, y) for x, y in reversed(right)]
-
-    poly = right + left
+    poly = np.concatenate([xy, xy[::-1] * np.array([-1.0, 1.0])])
 
     # Close polygon explicitly if needed
-    if poly and poly[0] != poly[-1]:
-        poly.append(poly[0])
+    if not np.array_equal(poly[0], poly[-1]):
+        poly = np.vstack([poly, poly[:1]])
 
     return poly
 
 
 def plot_mirror_fill(
-    points: List[Tuple[float, float, int]],
+    xy: np.ndarray,
+    idx: np.ndarray,
     annotate: bool,
     save_path: Optional[Path],
     title: str,
 ) -> None:
     import matplotlib.pyplot as plt
 
-    if not points:
+    if len(xy) == 0:
         raise RuntimeError("No points found for requested type/header/record_len.")
 
     # Polyline (right)
-    xs = [x for x, y, _ in points]
-    ys = [y for x, y, _ in points]
+    xs = xy[:, 0]
+    ys = xy[:, 1]
 
     # Mirrored polyline (left)
-    mxs = [-x for x in reversed(xs)]
-    mys = list(reversed(ys))
+    mxs = -xs[::-1]
+    mys = ys[::-1]
 
     # Filled polygon
-    poly = mirror_and_close_polygon(points)
-    px = [p[0] for p in poly]
-    py = [p[1] for p in poly]
-
-    fig, ax = plt.subplots()
+    poly = mirror_and_close_polygon(xy)
+    px = poly[:, 0]
+    py = poly[:, 1]
+
+    # Size the figure from the data aspect and fix margins, so savefig needs no tight-bbox pass
+    span_x = 2.0 * float(np.abs(xs).max()) or 1.0
+    span_y = float(np.ptp(ys)) or 1.0
+    fig_w = 6.4
+    fig_h = float(np.clip(fig_w * span_y / span_x, 3.0, 12.0))
+    fig, ax = plt.subplots(figsize=(fig_w, fig_h))
+    fig.subplots_adjust(left=0.1, right=0.97, top=0.93, bottom=0.1)
     ax.set_title(title)
 
     # Fill first (so lines/points sit on top)
-    ax.fill(px, py, alpha=0.25)
+    # Heavy artists are rasterized; axes / labels stay vector when saving to svg/pdf.
+    ax.fill(px, py, alpha=0.25, rasterized=True)
 
     # Draw polylines
-    ax.plot(xs, ys, marker="o")
-    ax.plot(mxs, mys, marker="o")
+    marker = "o" if (annotate or len(xy) <= _MAX_VERTEX_DOTS) else None
+    (line_r,) = ax.plot(xs, ys, marker=marker)
+    (line_l,) = ax.plot(mxs, mys, marker=marker)
+    line_r.set_rasterized(True)
+    line_l.set_rasterized(True)
 
     # Centerline
     ax.axvline(0.0, linewidth=1)
 
     if annotate:
-        for x, y, i in points:
+        for (x, y), i in zip(xy, idx):
             ax.annotate(str(i), (x, y), textcoords="offset points", xytext=(4, 4), fontsize=8)
 
     ax.set_aspect("equal", adjustable="datalim")
@@ -175,7 +170,7 @@ def plot_mirror_fill(
 
     if save_path:
         save_path.parent.mkdir(parents=True, exist_ok=True)
-        fig.savefig(save_path, dpi=150, bbox_inches="tight")
+        fig.savefig(save_path, dpi=150)
         print(f"[OK] saved: {save_path}")
     else:
         plt.show()
@@ -193,16 +188,20 @@ def main() -> int:
     ap.add_argument("--type", type=int, default=76, help="Record type to use as points")
     ap.add_argument("--save", default="", help="If set, save PNG to this path")
     ap.add_argument("--annotate", action="store_true")
+    ap.add_argument("--simplify-tol", type=float, default=None, help="Douglas-Peucker tolerance to thin points before plotting")
     args = ap.parse_args()
 
     db_path = Path(args.db)
     blob = read_geometry_polyline_blob(db_path, args.geometry_id)
 
-    points = extract_points_f64_be(blob, args.header, args.record_len, args.type)
+    xy, idx = extract_points_f64_be(blob, args.header, args.record_len, args.type)
+    if args.simplify_tol:
+        keep = simplify_polyline_rdp(xy[:, 0], xy[:, 1], args.simplify_tol)
+        xy, idx = xy[keep], idx[keep]
 
     save_path = Path(args.save) if args.save else None
     title = f"geometry_id={args.geometry_id} mirror+fill (header={args.header}, record={args.record_len}, type={args.type})"
-    plot_mirror_fill(points, annotate=args.annotate, save_path=save_path, title=title)
+    plot_mirror_fill(xy, idx, annotate=args.annotate, save_path=save_path, title=title)
     return 0
 
 
@@ -2,15 +2,21 @@
 from __future__ import annotations
 
 
-from .folders import get_nctools_folder_paths
+from .db import db_cache_key
+from .folders import FolderColumns, get_nctools_folder_columns, get_nctools_folder_paths
 from .export import (
+    export_nctools_to_excel,
     export_nc_tool_list_for_folder_path,
     export_all_nctools_to_excel_fast,
     export_all_nctools_to_excel_by_sheet,
 )
 
 __all__ = [
+    "db_cache_key",
+    "FolderColumns",
+    "get_nctools_folder_columns",
     "get_nctools_folder_paths",
+    "export_nctools_to_excel",
     "export_nc_tool_list_for_folder_path",
     "export_all_nctools_to_excel_fast",
     "export_all_nctools_to_excel_by_sheet",
@@ -5,11 +5,78 @@ import sqlite3
 from pathlib import Path
 
 def connect_readonly(db_path: Path) -> sqlite3.Connection:
-    db_uri = f"file:{db_path.as_posix()}?mode=ro"
-    return sqlite3.connect(db_uri, uri=True)
+    # パスに '#' '?' '%' や空白があっても壊れないよう、as_uri() でエスケープ済みの URI を作る
+    db_uri = Path(db_path).resolve().as_uri() + "?mode=ro"
+    conn = sqlite3.connect(db_uri, uri=True)
+    # 読み取り専用向けの調整：mmap で OS のファイルキャッシュから直接読む / ページキャッシュ 64MB /
+    # 再帰 CTE・ORDER BY の一時領域はメモリ上に置く
+    # （journal_mode=WAL は書き込み接続でしか切り替えられないのでここでは触らない）
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA cache_size=-65536")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+def db_cache_key(db_path: Path) -> tuple[str, int, int, int]:
+    """
+    DBファイル単位のキャッシュのキー：(パス, 本体の mtime, -wal の mtime, -wal のサイズ)。
+    WAL モードではコミットが -wal ファイルに書かれて本体の mtime は変わらないので、-wal も見る（無ければ 0, 0）。
+    """
+    p = Path(db_path)
+    main = p.stat()
+    try:
+        wal = p.with_name(p.name + "-wal").stat()
+        wal_mtime, wal_size = wal.st_mtime_ns, wal.st_size
+    except FileNotFoundError:
+        wal_mtime, wal_size = 0, 0
+    return (str(p), main.st_mtime_ns, wal_mtime, wal_size)
 
 def fetch_one_int(conn: sqlite3.Connection, sql: str, params: tuple) -> int | None:
     cur = conn.cursor()
     cur.execute(sql, params)
     row = cur.fetchone()
     return int(row[0]) if row else None
+
+# 読み取りクエリ（フォルダ再帰 CTE / NCTools の folder_id 絞り込み / Components の nctool_id, position 順集計）が使う索引
+# (索引名, テーブル, 列)
+READ_INDEXES: tuple[tuple[str, str, tuple[str, ...]], ...] = (
+    ("ix_folders_parent", "Folders", ("parent_id",)),
+    ("ix_nctools_folder_num", "NCTools", ("folder_id", "nc_number_val")),
+    ("ix_components_nctool_pos", "Components", ("nctool_id", "position")),
+)
+
+def missing_read_indexes(conn: sqlite3.Connection) -> list[tuple[str, str, tuple[str, ...]]]:
+    """
+    READ_INDEXES のうち、同じ先頭列を持つ索引がまだ無いものを返す。
+    テーブルや列が存在しないもの（DB差分）は対象外。
+    """
+    missing = []
+    for name, table, cols in READ_INDEXES:
+        table_cols = {r[1] for r in conn.execute(f'PRAGMA table_info("{table}")')}
+        if not table_cols or not set(cols) <= table_cols:
+            continue
+        covered = False
+        for idx in conn.execute(f'PRAGMA index_list("{table}")').fetchall():
+            idx_cols = tuple(r[2] for r in conn.execute(f'PRAGMA index_info("{idx[1]}")'))
+            if idx_cols[: len(cols)] == cols:
+                covered = True
+                break
+        if not covered:
+            missing.append((name, table, cols))
+    return missing
+
+def ensure_read_indexes(db_path: Path) -> list[str]:
+    """
+    足りない READ_INDEXES を作成する（DBに書き込むので明示的に呼んだ時だけ）。
+    作成した索引名を返す。
+    """
+    conn = sqlite3.connect(str(db_path))
+    try:
+        created = []
+        for name, table, cols in missing_read_indexes(conn):
+            col_sql = ", ".join(f'"{c}"' for c in cols)
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}"({col_sql})')
+            created.append(name)
+        conn.commit()
+        return created
+    finally:
+        conn.close()
@@ -1,20 +1,21 @@
 # src/hypermill_nctools_inventory_exporter/export.py
 from __future__ import annotations
 
+import importlib.util
 from pathlib import Path
-from typing import Callable, Optional
+from typing import Any, Callable, Iterable, Optional
 
-import pandas as pd
-
-from .db import connect_readonly
+from .db import connect_readonly, db_cache_key
+from .folders import get_nctools_folder_columns, resolve_folder_id_by_nctools_path
 from .queries import (
     NCTOOLS_FOR_FOLDER_SQL_TEMPLATE,
-    NCTOOLS_ALL_FAST_SQL_TEMPLATE,
+    NCTOOLS_FOR_FOLDER_EXT_SQL_TEMPLATE,
+    NCTOOLS_ALL_FAST_SQL,
+    NCTOOLS_COMP_AGG_TEMP_LEGACY_SQL_TEMPLATE,
+    NCTOOLS_COMP_AGG_TEMP_SQL_TEMPLATE,
+    NCTOOLS_FOLDER_TREE_TEMP_SQL,
 )
 
-import hypermill_nctools_inventory_exporter.export as ex
-print("export.py loaded from:", ex.__file__)
-
 RENAME_MAP = {
     "gage_length": "ゲージ長",
     "tool_length": "tool_length（刃物側突き出し）",
@@ -25,6 +26,23 @@ RENAME_MAP = {
 
 ProgressCb = Callable[[int, int, str], None]  # (done, total, message)
 
+# xlsx の書き込みエンジン。xlsxwriter が入っていればそちらを使う（openpyxl より速く省メモリ）
+# 入っていない環境では従来どおり openpyxl
+EXCEL_ENGINE = "xlsxwriter" if importlib.util.find_spec("xlsxwriter") is not None else "openpyxl"
+
+# pandas は import が重い（数百ms）ので、DataFrame 操作が要る出力の時だけ読み込む
+# 平坦な出力（フォルダ一覧 / 全件 / シート分割）は _XlsxStreamWriter で直接書くので pandas 不要
+_PANDAS: Any = None
+
+
+def _pd() -> Any:
+    global _PANDAS
+    if _PANDAS is None:
+        import pandas
+
+        _PANDAS = pandas
+    return _PANDAS
+
 
 def _sanitize_sheet_name(name: str) -> str:
     """
@@ -43,24 +61,93 @@ def _sanitize_sheet_name(name: str) -> str:
 def _dedupe_sheet_name(name: str, used: set[str]) -> str:
     """
     同一シート名が出た場合に _01, _02 ... を付与して重複回避する。
+    Excel のシート名は大文字小文字を区別しないので、used には casefold した名前を入れて比較する。
     31文字制限を維持する。
     """
     base = name
-    if base not in used:
-        used.add(base)
+    if base.casefold() not in used:
+        used.add(base.casefold())
         return base
 
     for i in range(1, 1000):
         suffix = f"_{i:02d}"
         trimmed = base[: (31 - len(suffix))]
         candidate = trimmed + suffix
-        if candidate not in used:
-            used.add(candidate)
+        if candidate.casefold() not in used:
+            used.add(candidate.casefold())
             return candidate
 
     raise RuntimeError("シート名の重複解決に失敗しました（想定外の大量重複）")
 
 
+class _XlsxStreamWriter:
+    """
+    DataFrame を経由せずに、シートごとにヘッダ + 行を順に書き出す XLSX ライタ。
+    行は1行ずつ流し込むので、全件をメモリに載せずに済む（xlsxwriter: constant_memory / openpyxl: write_only）。
+    ヘッダは書式なしの文字列として書く（従来の出力と同じ見た目）。
+    """
+
+    def __init__(self, output_path: Path) -> None:
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        self._path = output_path
+        self._ws: Any = None
+        self._row = 0
+        if EXCEL_ENGINE == "xlsxwriter":
+            import xlsxwriter
+
+            self._wb = xlsxwriter.Workbook(str(output_path), {"constant_memory": True, "use_zip64": True})
+        else:
+            from openpyxl import Workbook
+
+            self._wb = Workbook(write_only=True)
+
+    def add_sheet(self, sheet_name: str, columns: list[str]) -> None:
+        if EXCEL_ENGINE == "xlsxwriter":
+            self._ws = self._wb.add_worksheet(sheet_name)
+        else:
+            self._ws = self._wb.create_sheet(sheet_name)
+        self._row = 0
+        self.append(columns)
+
+    def append(self, row: Iterable[Any]) -> None:
+        if EXCEL_ENGINE == "xlsxwriter":
+            self._ws.write_row(self._row, 0, row)
+        else:
+            self._ws.append(list(row))
+        self._row += 1
+
+    def close(self) -> None:
+        if EXCEL_ENGINE == "xlsxwriter":
+            self._wb.close()
+        else:
+            self._wb.save(self._path)
+
+
+def _write_rows_xlsx(output_path: Path, columns: list[str], rows: Iterable[Iterable[Any]], sheet_name: str = "Sheet1") -> None:
+    """
+    ヘッダ + 行をそのまま1シートの XLSX に書く。カーソルをそのまま rows に渡してよい。
+    """
+    writer = _XlsxStreamWriter(output_path)
+    try:
+        writer.add_sheet(sheet_name, columns)
+        for row in rows:
+            writer.append(row)
+    finally:
+        # 途中で例外が出ても xlsxwriter の一時ファイル（constant_memory）を残さない
+        writer.close()
+
+
+def export_nctools_to_excel(db_path: Path, output_path: Path) -> None:
+    """
+    NCTools 配下のフォルダツリー（path, depth, name, obj_guid, comment）を path 順で1シートに出力。
+    平坦な一覧なので pandas は使わずに直接書く。
+    """
+    cols = get_nctools_folder_columns(db_path, with_guid=True)
+    order = sorted(range(len(cols)), key=cols.paths.__getitem__)
+    rows = zip(*[[col[i] for i in order] for col in (cols.paths, cols.depths, cols.names, cols.obj_guids, cols.comments)])
+    _write_rows_xlsx(output_path, ["path", "depth", "name", "obj_guid", "comment"], rows)
+
+
 def _detect_components_reach_col(conn) -> str:
     """
     Components テーブルの「延長長さ寄与」列名を推定して返す。
@@ -91,39 +178,29 @@ def _detect_components_reach_col(conn) -> str:
     )
 
 
-def _resolve_folder_id_by_nctools_path(conn, nctools_folder_path: str) -> int:
-    r"""
-    'DD(...)\DD0600...' のような NCTools直下パスを folder_id に解決する。
+# DBファイルごとのスキーマ情報 (reach列名, NCTools の folder_id)
+# key: db_cache_key（パス + 本体と -wal の mtime/サイズ）。ファイルが更新されたら取り直す
+_SCHEMA_CACHE: dict[tuple[str, int, int, int], tuple[str, int | None]] = {}
+
+
+def _schema_info(conn, db_path: Path) -> tuple[str, int | None]:
     """
-    cur = conn.cursor()
+    reach 列名と NCTools ルートの folder_id を返す。同じDBファイルなら2回目以降は問い合わせない。
+    """
+    key = db_cache_key(db_path)
+    hit = _SCHEMA_CACHE.get(key)
+    if hit is not None:
+        return hit
 
-    cur.execute("SELECT folder_id FROM Folders WHERE name='NCTools' LIMIT 1")
-    row = cur.fetchone()
-    if not row:
-        raise RuntimeError("Folders に 'NCTools' が見つかりません")
-    root_id = int(row[0])
-
-    cur.execute(
-        r"""
-        WITH RECURSIVE tree(folder_id, parent_id, name, path) AS (
-          SELECT folder_id, parent_id, name, name as path
-          FROM Folders
-          WHERE parent_id = ?
-          UNION ALL
-          SELECT f.folder_id, f.parent_id, f.name, tree.path || '\' || f.name
-          FROM Folders f
-          JOIN tree ON f.parent_id = tree.folder_id
-        )
-        SELECT folder_id
-        FROM tree
-        WHERE path = ?
-        """,
-        (root_id, nctools_folder_path),
-    )
-    row = cur.fetchone()
-    if not row:
-        raise RuntimeError(f"指定パスが見つかりません: {nctools_folder_path}")
-    return int(row[0])
+    reach_col = _detect_components_reach_col(conn)
+    row = conn.execute("SELECT folder_id FROM Folders WHERE name='NCTools' LIMIT 1").fetchone()
+    info = (reach_col, int(row[0]) if row else None)
+
+    # 同じDBの古いエントリは捨てる
+    for k in [k for k in _SCHEMA_CACHE if k[0] == key[0]]:
+        del _SCHEMA_CACHE[k]
+    _SCHEMA_CACHE[key] = info
+    return info
 
 
 def export_nc_tool_list_for_folder_path(db_path: Path, nctools_folder_path: str, output_path: Path) -> None:
@@ -133,9 +210,9 @@ def export_nc_tool_list_for_folder_path(db_path: Path, nctools_folder_path: str,
     """
     conn = connect_readonly(db_path)
     try:
-        reach_col = _detect_components_reach_col(conn)
+        reach_col, root_id = _schema_info(conn, db_path)
 
-        folder_id = _resolve_folder_id_by_nctools_path(conn, nctools_folder_path)
+        folder_id = resolve_folder_id_by_nctools_path(conn, nctools_folder_path, root_id)
 
         sql = NCTOOLS_FOR_FOLDER_SQL_TEMPLATE.format(reach_col=reach_col)
         if reach_col == "reach_val":
@@ -143,15 +220,44 @@ def export_nc_tool_list_for_folder_path(db_path: Path, nctools_folder_path: str,
 
 
         cur = conn.cursor()
-        cur.execute(sql, (nctools_folder_path, folder_id))
+        cur.execute(sql, {"path": nctools_folder_path, "folder_id": folder_id})
         rows = cur.fetchall()
         cols = [d[0] for d in cur.description]
+
+        # 延長構成は GROUP_CONCAT を使わず、平坦に取ってから pandas でまとめる
+        cur.execute(NCTOOLS_FOR_FOLDER_EXT_SQL_TEMPLATE.format(reach_col=reach_col), (folder_id,))
+        ext_rows = cur.fetchall()
     finally:
         conn.close()
 
-    df = pd.DataFrame(rows, columns=cols).rename(columns=RENAME_MAP)
+    pd = _pd()
+    df = pd.DataFrame(rows, columns=cols)
+    ext = pd.DataFrame(ext_rows, columns=["nctool_id", "ext"]).groupby("nctool_id", sort=False)["ext"].agg(" / ".join)
+    df["extensions"] = df["nctool_id"].map(ext)
+    df = df.rename(columns=RENAME_MAP)
     output_path.parent.mkdir(parents=True, exist_ok=True)
-    df.to_excel(output_path, index=False)
+    df.to_excel(output_path, index=False, engine=EXCEL_ENGINE)
+
+
+def _sqlite_version(conn) -> tuple[int, ...]:
+    # sqlite3.sqlite_version_info ではなく、実際に接続しているライブラリの版を見る
+    (ver,) = conn.execute("SELECT sqlite_version()").fetchone()
+    return tuple(int(p) for p in ver.split("."))
+
+
+def _build_all_nctools_temp_tables(conn, reach_col: str) -> None:
+    """
+    NCTOOLS_ALL_FAST_SQL が参照する TEMP テーブル（NCTools 配下のフォルダツリー / 延長構成の集計）を作る。
+    結合キーに索引を張った表に一度書き出してから結合するほうが、CTE のまま結合するより速い。
+    エクスポートごとに接続を開き直すので、呼ぶたびに作り直す（キャッシュではない）。
+    """
+    conn.executescript(NCTOOLS_FOLDER_TREE_TEMP_SQL)
+    # 集計関数内の ORDER BY は SQLite 3.44 から。それより古いライブラリでは並べ替え済みサブクエリ版を使う
+    if _sqlite_version(conn) >= (3, 44, 0):
+        comp_agg_sql = NCTOOLS_COMP_AGG_TEMP_SQL_TEMPLATE
+    else:
+        comp_agg_sql = NCTOOLS_COMP_AGG_TEMP_LEGACY_SQL_TEMPLATE
+    conn.executescript(comp_agg_sql.format(reach_col=reach_col))
 
 
 def export_all_nctools_to_excel_fast(
@@ -167,27 +273,22 @@ def export_all_nctools_to_excel_fast(
 
     conn = connect_readonly(db_path)
     try:
-        reach_col = _detect_components_reach_col(conn)
-
-        sql = NCTOOLS_ALL_FAST_SQL_TEMPLATE.format(reach_col=reach_col)
+        reach_col, _ = _schema_info(conn, db_path)
         if reach_col == "reach_val":
             raise RuntimeError("BUG: reach_col resolved to 'reach_val' (not a real column). Check export.py candidates and import cache.")
 
-
+        _build_all_nctools_temp_tables(conn, reach_col)
         cur = conn.cursor()
-        cur.execute(sql)
-        rows = cur.fetchall()
-        cols = [d[0] for d in cur.description]
-    finally:
-        conn.close()
+        cur.execute(NCTOOLS_ALL_FAST_SQL)
+        cols = [RENAME_MAP.get(d[0], d[0]) for d in cur.description]
 
-    df = pd.DataFrame(rows, columns=cols).rename(columns=RENAME_MAP)
+        if progress:
+            progress(1, 2, "Excelを書き込み中...")
 
-    if progress:
-        progress(1, 2, "Excelを書き込み中...")
-
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    df.to_excel(output_path, index=False)
+        # fetchall / DataFrame を挟まず、カーソルから1行ずつ書き出す
+        _write_rows_xlsx(output_path, cols, cur)
+    finally:
+        conn.close()
 
     if progress:
         progress(2, 2, "完了")
@@ -207,35 +308,39 @@ def export_all_nctools_to_excel_by_sheet(
 
     conn = connect_readonly(db_path)
     try:
-        reach_col = _detect_components_reach_col(conn)
-
-        sql = NCTOOLS_ALL_FAST_SQL_TEMPLATE.format(reach_col=reach_col)
+        reach_col, _ = _schema_info(conn, db_path)
         if reach_col == "reach_val":
             raise RuntimeError("BUG: reach_col resolved to 'reach_val' (not a real column). Check export.py candidates and import cache.")
 
-
+        _build_all_nctools_temp_tables(conn, reach_col)
         cur = conn.cursor()
-        cur.execute(sql)
-        rows = cur.fetchall()
-        cols = [d[0] for d in cur.description]
+        cur.execute(NCTOOLS_ALL_FAST_SQL)
+        cols = [RENAME_MAP.get(d[0], d[0]) for d in cur.description]
+        key_idx = [d[0] for d in cur.description].index("nctools_folder_path")
+
+        if progress:
+            progress(1, 2, "Excel（シート分割）を書き込み中...")
+
+        # SQL が nctools_folder_path 順に返すので、キーが変わったところで次のシートに切り替えるだけで
+        # groupby(sort=True) と同じシート順・行順になる。DataFrame は作らない
+        writer = _XlsxStreamWriter(output_path)
+        try:
+            used: set[str] = set()
+            current: Any = None
+            for row in cur:
+                folder_path = row[key_idx]
+                if folder_path is None:
+                    continue
+                if not used or folder_path != current:
+                    current = folder_path
+                    writer.add_sheet(_dedupe_sheet_name(_sanitize_sheet_name(str(folder_path)), used), cols)
+                writer.append(row)
+            if not used:
+                writer.add_sheet("Empty", cols)
+        finally:
+            writer.close()
     finally:
         conn.close()
 
-    df_all = pd.DataFrame(rows, columns=cols).rename(columns=RENAME_MAP)
-
-    if progress:
-        progress(1, 2, "Excel（シート分割）を書き込み中...")
-
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-
-    used: set[str] = set()
-    with pd.ExcelWriter(output_path, engine="openpyxl") as writer:
-        if df_all.empty:
-            df_all.to_excel(writer, sheet_name="Empty", index=False)
-        else:
-            for folder_path, g in df_all.groupby("nctools_folder_path", sort=True):
-                sheet = _dedupe_sheet_name(_sanitize_sheet_name(str(folder_path)), used)
-                g.to_excel(writer, sheet_name=sheet, index=False)
-
     if progress:
         progress(2, 2, "完了")
@@ -1,10 +1,12 @@
 # src/hypermill_nctools_inventory_exporter/folders.py
 from __future__ import annotations
 
-import uuid
 import sqlite3
 from dataclasses import dataclass
 from typing import Any
+
+import numpy as np
+
 from .db import connect_readonly
 
 @dataclass(frozen=True)
@@ -16,31 +18,45 @@ class FolderRow:
     comment: str | None
 
 def _uuid_from_blob(blob: Any) -> str | None:
-    if blob is None:
-        return None
-    try:
-        return str(uuid.UUID(bytes_le=blob))
-    except Exception:
+    # str(uuid.UUID(bytes_le=blob)) と同じ文字列を、UUID オブジェクトを作らずに組み立てる
+    # （先頭3フィールドだけバイト順を反転して16進化）。16バイトの bytes 以外は None
+    if not isinstance(blob, bytes) or len(blob) != 16:
         return None
+    h = (blob[3::-1] + blob[5:3:-1] + blob[7:5:-1] + blob[8:]).hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
 
-def _fetch_folders(conn: sqlite3.Connection) -> tuple[dict[int, FolderRow], dict[int | None, list[int]]]:
-    cur = conn.cursor()
-    cur.execute("SELECT folder_id, parent_id, name, obj_guid, comment FROM Folders")
-    nodes: dict[int, FolderRow] = {}
-    children: dict[int | None, list[int]] = {}
-
-    for folder_id, parent_id, name, obj_guid, comment in cur.fetchall():
-        row = FolderRow(
-            folder_id=int(folder_id),
-            parent_id=int(parent_id) if parent_id is not None else None,
-            name=str(name),
-            obj_guid=_uuid_from_blob(obj_guid),
-            comment=str(comment) if comment is not None else None,
-        )
-        nodes[row.folder_id] = row
-        children.setdefault(row.parent_id, []).append(row.folder_id)
-
-    return nodes, children
+# bytes_le -> RFC 表記のバイト順（先頭3フィールドだけリトルエンディアン）
+_UUID_LE_PERM = np.array([3, 2, 1, 0, 5, 4, 7, 6, 8, 9, 10, 11, 12, 13, 14, 15])
+# 36文字表記のうち16進数字が入る位置（残りは '-'）
+_UUID_HEX_POS = np.array([i for i in range(36) if i not in (8, 13, 18, 23)])
+_HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+# これより少ない件数は1件ずつ変換した方が速い
+_UUID_VECTOR_MIN = 128
+
+def _uuids_from_blobs(blobs: list[Any]) -> list[str | None]:
+    """
+    _uuid_from_blob を列単位で行う。16バイトの bytes 以外は None。
+    バイトの並べ替えと16進化は NumPy でまとめて行う。
+    """
+    if len(blobs) < _UUID_VECTOR_MIN:
+        return [_uuid_from_blob(b) for b in blobs]
+
+    valid = np.fromiter((isinstance(b, bytes) and len(b) == 16 for b in blobs), dtype=bool, count=len(blobs))
+    out: list[str | None] = [None] * len(blobs)
+    idx = np.flatnonzero(valid)
+    if idx.size == 0:
+        return out
+
+    raw = np.frombuffer(b"".join(blobs[i] for i in idx), dtype=np.uint8).reshape(-1, 16)[:, _UUID_LE_PERM]
+    hexed = np.empty((len(raw), 32), dtype=np.uint8)
+    hexed[:, 0::2] = _HEX_DIGITS[raw >> 4]
+    hexed[:, 1::2] = _HEX_DIGITS[raw & 0x0F]
+    text = np.full((len(raw), 36), ord("-"), dtype=np.uint8)
+    text[:, _UUID_HEX_POS] = hexed
+
+    for i, u in zip(idx.tolist(), text.view("S36").ravel().astype("U36").tolist()):
+        out[i] = u
+    return out
 
 def _find_root_folder_id(conn: sqlite3.Connection, root_name: str) -> int:
     cur = conn.cursor()
@@ -50,72 +66,112 @@ def _find_root_folder_id(conn: sqlite3.Connection, root_name: str) -> int:
         raise RuntimeError(f"Root folder not found: {root_name!r}")
     return int(row[0])
 
-def _collect_subtree_paths(
-    nodes: dict[int, FolderRow],
-    children: dict[int | None, list[int]],
-    root_id: int,
-    sep: str = "\\",
-) -> list[dict[str, Any]]:
-    records: list[dict[str, Any]] = []
-
-    def walk(node_id: int, stack: list[str]) -> None:
-        node = nodes[node_id]
-        stack2 = stack + [node.name]
-        path = sep.join(stack2)
-        records.append(
-            {
-                "path": path,
-                "depth": len(stack2),
-                "name": node.name,
-                "obj_guid": node.obj_guid,
-                "comment": node.comment,
-            }
-        )
-        for child_id in children.get(node_id, []):
-            walk(child_id, stack2)
-
-    for child_id in children.get(root_id, []):
-        walk(child_id, [])
-    return records
-
-def get_nctools_folder_paths(db_path) -> list[dict[str, Any]]:
+# NCTools 配下を再帰 CTE で辿り、path / depth を SQL 側で組み立てる
+# sort_key は rowid を固定幅で連結したもので、これで並べると前順（親→子、兄弟は rowid 順）になる
+_SUBTREE_PATHS_SQL = r"""
+WITH RECURSIVE tree(folder_id, path, depth, sort_key) AS (
+  SELECT folder_id, name, 1, printf('%012d', rowid)
+  FROM Folders
+  WHERE parent_id = :root_id
+
+  UNION ALL
+
+  SELECT f.folder_id, tree.path || :sep || f.name, tree.depth + 1, tree.sort_key || printf('%012d', f.rowid)
+  FROM Folders f
+  JOIN tree ON f.parent_id = tree.folder_id
+)
+SELECT tree.path, tree.depth, f.name, {guid_col}, f.comment
+FROM tree
+JOIN Folders f ON f.folder_id = tree.folder_id
+ORDER BY tree.sort_key
+"""
+
+@dataclass(frozen=True)
+class FolderColumns:
+    """
+    NCTools 配下のフォルダを列ごとのリストで持つ（1フォルダ = 1 dict を作らない）。
+    各リストは同じ長さで、同じ index が同じフォルダ。並びは前順。
+    """
+    paths: list[str]
+    depths: list[int]
+    names: list[str]
+    obj_guids: list[str | None]
+    comments: list[str | None]
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+def get_nctools_folder_columns(db_path, with_guid: bool = False, sep: str = "\\") -> FolderColumns:
+    """
+    NCTools 配下のフォルダを前順で列ごとに返す（path, depth, name, obj_guid, comment）。
+    obj_guid の UUID 変換は with_guid=True の時だけ行う（path だけ使う呼び出し側のため）。
+    """
     conn = connect_readonly(db_path)
     try:
-        nodes, children = _fetch_folders(conn)
         root_id = _find_root_folder_id(conn, "NCTools")
-        return _collect_subtree_paths(nodes, children, root_id)
+        sql = _SUBTREE_PATHS_SQL.format(guid_col="f.obj_guid" if with_guid else "NULL")
+        cur = conn.cursor()
+        cur.execute(sql, {"root_id": root_id, "sep": sep})
+        rows = cur.fetchall()
     finally:
         conn.close()
 
-def resolve_folder_id_by_nctools_path(conn: sqlite3.Connection, nctools_folder_path: str) -> int:
+    paths, depths, names, guids, comments = (list(c) for c in zip(*rows)) if rows else ([], [], [], [], [])
+    return FolderColumns(
+        paths=[str(p) for p in paths],
+        depths=[int(d) for d in depths],
+        names=[str(n) for n in names],
+        obj_guids=_uuids_from_blobs(guids) if with_guid else guids,
+        comments=[str(c) if c is not None else None for c in comments],
+    )
+
+def get_nctools_folder_paths(db_path, with_guid: bool = False, sep: str = "\\") -> list[dict[str, Any]]:
+    """
+    get_nctools_folder_columns の1フォルダ1 dict 版（path, depth, name, obj_guid, comment）。
+    """
+    cols = get_nctools_folder_columns(db_path, with_guid=with_guid, sep=sep)
+    return [
+        {"path": p, "depth": d, "name": n, "obj_guid": g, "comment": c}
+        for p, d, n, g, c in zip(cols.paths, cols.depths, cols.names, cols.obj_guids, cols.comments)
+    ]
+
+# NCTools 直下パス → folder_id の解決用。:target は末尾に区切り '\' を付けた目的パス
+# 目的パスの接頭辞にならない枝は再帰に入れず、見つかった時点で LIMIT 1 で打ち切る
+_RESOLVE_PATH_SQL = r"""
+WITH RECURSIVE tree(folder_id, path) AS (
+  SELECT folder_id, name
+  FROM Folders
+  WHERE parent_id = :root_id
+    AND instr(:target, name || '\') = 1
+
+  UNION ALL
+
+  SELECT f.folder_id, tree.path || '\' || f.name
+  FROM Folders f
+  JOIN tree ON f.parent_id = tree.folder_id
+  WHERE instr(:target, tree.path || '\' || f.name || '\') = 1
+)
+SELECT folder_id
+FROM tree
+WHERE path || '\' = :target
+LIMIT 1
+"""
+
+def resolve_folder_id_by_nctools_path(conn: sqlite3.Connection, nctools_folder_path: str, root_id: int | None = None) -> int:
     """
     'DD(...)\DD0600...' のような NCTools直下パスを folder_id に解決する。
+    root_id（NCTools の folder_id）が分かっていれば渡す。
     """
     cur = conn.cursor()
 
-    cur.execute("SELECT folder_id FROM Folders WHERE name='NCTools'")
-    row = cur.fetchone()
-    if not row:
-        raise RuntimeError("Folders に 'NCTools' が見つかりません")
-    root_id = int(row[0])
-
-    cur.execute(
-        r"""
-        WITH RECURSIVE tree(folder_id, parent_id, name, path) AS (
-          SELECT folder_id, parent_id, name, name as path
-          FROM Folders
-          WHERE parent_id = ?
-          UNION ALL
-          SELECT f.folder_id, f.parent_id, f.name, tree.path || '\' || f.name
-          FROM Folders f
-          JOIN tree ON f.parent_id = tree.folder_id
-        )
-        SELECT folder_id
-        FROM tree
-        WHERE path = ?
-        """,
-        (root_id, nctools_folder_path),
-    )
+    if root_id is None:
+        cur.execute("SELECT folder_id FROM Folders WHERE name='NCTools'")
+        row = cur.fetchone()
+        if not row:
+            raise RuntimeError("Folders に 'NCTools' が見つかりません")
+        root_id = int(row[0])
+
+    cur.execute(_RESOLVE_PATH_SQL, {"root_id": root_id, "target": nctools_folder_path + "\\"})
     row = cur.fetchone()
     if not row:
         raise RuntimeError(f"指定パスが見つかりません: {nctools_folder_path}")
@@ -1,10 +1,14 @@
 from __future__ import annotations
 
 import sqlite3
-import struct
-from dataclasses import dataclass
+from collections import Counter
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Iterable
+from typing import Any, Iterable, Iterator
+
+import numpy as np
+
+from .db import connect_readonly
 
 
 @dataclass(frozen=True)
@@ -13,36 +17,117 @@ class PolylineFormat:
     record_len: int
 
 
+@dataclass(frozen=True)
+class _PayloadViews:
+    """
+    全レコードの payload (N, record_len-2) を、各解釈の2次元配列として1回だけ読み替えたもの。
+    """
+    f64_le: np.ndarray
+    f64_be: np.ndarray
+    f32_le: np.ndarray
+    i32_le: np.ndarray
+
+    @classmethod
+    def from_payloads(cls, payloads: np.ndarray) -> _PayloadViews:
+        def view(dtype: str) -> np.ndarray:
+            size = np.dtype(dtype).itemsize
+            return payloads[:, : (payloads.shape[1] // size) * size].view(dtype)
+
+        return cls(view("<f8"), view(">f8"), view("<f4"), view("<i4"))
+
+
 @dataclass(frozen=True)
 class PolylineRecord:
     index: int
     offset: int
     rec_type_u16: int
     payload: bytes
+    _views: _PayloadViews = field(repr=False, compare=False)
 
     # 観測用：同じpayloadを複数の解釈で持つ（まだ確定しない）
-    f64_le: tuple[float, ...]
-    f64_be: tuple[float, ...]
-    f32_le: tuple[float, ...]
-    i32_le: tuple[int, ...]
-
-
-def read_geometry_polyline_blob(db_path: Path, geometry_id: int) -> bytes:
+    # 実体は _views の行で、参照された時だけ tuple にする
+    @property
+    def f64_le(self) -> tuple[float, ...]:
+        return tuple(self._views.f64_le[self.index].tolist())
+
+    @property
+    def f64_be(self) -> tuple[float, ...]:
+        return tuple(self._views.f64_be[self.index].tolist())
+
+    @property
+    def f32_le(self) -> tuple[float, ...]:
+        return tuple(self._views.f32_le[self.index].tolist())
+
+    @property
+    def i32_le(self) -> tuple[int, ...]:
+        return tuple(self._views.i32_le[self.index].tolist())
+
+
+def _blob_to_bytes(geometry_id: int, blob: Any) -> bytes:
+    if blob is None:
+        raise RuntimeError(f"Geometries.polyline が見つかりません: geometry_id={geometry_id}")
+    if not isinstance(blob, (bytes, bytearray, memoryview)):
+        raise RuntimeError(f"polyline の型が想定外です: {type(blob)}")
+    # sqlite3 は bytes で返すのでそのまま使う（コピーしない）。以降は np.frombuffer でビューとして読む
+    return blob if isinstance(blob, bytes) else bytes(blob)
+
+
+def read_geometry_polyline_blob(
+    db_path: Path,
+    geometry_id: int,
+    conn: sqlite3.Connection | None = None,
+    limit: int | None = None,
+) -> bytes:
     """
     Geometries.polyline (BLOB) を取得する。
+    conn を渡した場合はそれを使い、閉じない（複数件読む場合の接続使い回し用）。
+    limit を指定すると先頭 limit バイトだけ読む（incremental BLOB I/O が使える場合は残りを読まない）。
     """
-    db_uri = f"file:{db_path.as_posix()}?mode=ro"
-    conn = sqlite3.connect(db_uri, uri=True)
+    own_conn = conn is None
+    if own_conn:
+        conn = connect_readonly(db_path)
     try:
         cur = conn.cursor()
-        cur.execute("SELECT polyline FROM Geometries WHERE id = ?", (geometry_id,))
+        cur.execute("SELECT rowid, typeof(polyline) FROM Geometries WHERE id = ?", (geometry_id,))
+        row = cur.fetchone()
+        if not row or row[1] == "null":
+            return _blob_to_bytes(geometry_id, None)
+
+        # Python 3.11+: 値全体を SELECT で取り出さず、BLOB ハンドルから必要な分だけ読む
+        if row[1] == "blob" and hasattr(conn, "blobopen"):
+            with conn.blobopen("Geometries", "polyline", row[0], readonly=True) as b:
+                return b.read(-1 if limit is None else limit)
+
+        # limit 指定時は SQL 側で切り出し、全体を受け取ってからスライスコピーしない
+        if limit is None:
+            cur.execute("SELECT polyline FROM Geometries WHERE id = ?", (geometry_id,))
+        else:
+            cur.execute("SELECT substr(polyline, 1, ?) FROM Geometries WHERE id = ?", (int(limit), geometry_id))
         row = cur.fetchone()
-        if not row or row[0] is None:
-            raise RuntimeError(f"Geometries.polyline が見つかりません: geometry_id={geometry_id}")
-        blob = row[0]
-        if not isinstance(blob, (bytes, bytearray, memoryview)):
-            raise RuntimeError(f"polyline の型が想定外です: {type(blob)}")
-        return bytes(blob)
+        return _blob_to_bytes(geometry_id, row[0] if row else None)
+    finally:
+        if own_conn:
+            conn.close()
+
+
+def read_geometry_polyline_blobs(db_path: Path, geometry_ids: Iterable[int], chunk_size: int = 500) -> Iterator[tuple[int, bytes]]:
+    """
+    複数 geometry の polyline を1つの接続でまとめて読む。
+    (geometry_id, blob) を id 昇順で返す。polyline が無いものは飛ばす。
+    """
+    ids = sorted({int(g) for g in geometry_ids})
+    conn = connect_readonly(db_path)
+    try:
+        cur = conn.cursor()
+        for i in range(0, len(ids), chunk_size):
+            chunk = ids[i : i + chunk_size]
+            marks = ",".join("?" * len(chunk))
+            cur.execute(
+                f"SELECT id, polyline FROM Geometries WHERE id IN ({marks}) AND polyline IS NOT NULL ORDER BY id",
+                chunk,
+            )
+            for gid, blob in cur.fetchall():
+                yield int(gid), _blob_to_bytes(int(gid), blob)
     finally:
         conn.close()
 
@@ -51,8 +136,7 @@ def iter_geometry_ids_with_polyline(db_path: Path, limit: int = 2000) -> list[in
     """
     polyline を持つ geometry_id を列挙（先頭から）。
     """
-    db_uri = f"file:{db_path.as_posix()}?mode=ro"
-    conn = sqlite3.connect(db_uri, uri=True)
+    conn = connect_readonly(db_path)
     try:
         cur = conn.cursor()
         cur.execute(
@@ -70,82 +154,28 @@ def iter_geometry_ids_with_polyline(db_path: Path, limit: int = 2000) -> list[in
         conn.close()
 
 
-def _u16_le(b: bytes) -> int:
-    return struct.unpack_from("<H", b, 0)[0]
-
-
-def _try_unpack_f64(payload: bytes, endian: str) -> tuple[float, ...]:
-    """
-    endian: '<' or '>'
-    """
-    n = (len(payload) // 8) * 8
-    if n <= 0:
-        return tuple()
-    cnt = n // 8
-    try:
-        return struct.unpack_from(endian + ("d" * cnt), payload, 0)
-    except Exception:
-        return tuple()
-
-
-def _try_unpack_f32_le(payload: bytes) -> tuple[float, ...]:
-    n = (len(payload) // 4) * 4
-    if n <= 0:
-        return tuple()
-    cnt = n // 4
-    try:
-        return struct.unpack_from("<" + ("f" * cnt), payload, 0)
-    except Exception:
-        return tuple()
-
-
-def _try_unpack_i32_le(payload: bytes) -> tuple[int, ...]:
-    n = (len(payload) // 4) * 4
-    if n <= 0:
-        return tuple()
-    cnt = n // 4
-    try:
-        return struct.unpack_from("<" + ("i" * cnt), payload, 0)
-    except Exception:
-        return tuple()
-
-
 def parse_polyline(blob: bytes, fmt: PolylineFormat) -> tuple[bytes, list[PolylineRecord]]:
     """
     与えられた header_len / record_len で polyline を分解。
     先頭2バイトを u16(rec_type) とみなし、残りを payload として保持。
     payloadは f64(LE/BE), f32(LE), i32(LE) を併記して観測できるようにする。
+    （解釈は NumPy で全レコード分まとめて1回だけ行い、各レコードはその行を参照する）
     """
-    if fmt.header_len < 0 or fmt.record_len <= 0:
-        raise ValueError("invalid format")
-
-    if len(blob) < fmt.header_len:
-        raise ValueError("blob shorter than header")
-
-    body = blob[fmt.header_len:]
-    if (len(body) % fmt.record_len) != 0:
-        raise ValueError("body not divisible by record_len")
+    # 分解と形式チェックは polyline_columns と共通（同じ PolylineFormat で片方だけ失敗しないように）
+    rec_type_col, payloads = polyline_columns(blob, fmt)
+    rec_types = rec_type_col.tolist()
+    views = _PayloadViews.from_payloads(np.ascontiguousarray(payloads))
 
     recs: list[PolylineRecord] = []
-    nrec = len(body) // fmt.record_len
-
-    for i in range(nrec):
+    for i, rec_type in enumerate(rec_types):
         off = fmt.header_len + i * fmt.record_len
-        chunk = blob[off : off + fmt.record_len]
-
-        rec_type = _u16_le(chunk[:2])
-        payload = chunk[2:]
-
         recs.append(
             PolylineRecord(
                 index=i,
                 offset=off,
                 rec_type_u16=rec_type,
-                payload=payload,
-                f64_le=_try_unpack_f64(payload, "<"),
-                f64_be=_try_unpack_f64(payload, ">"),
-                f32_le=_try_unpack_f32_le(payload),
-                i32_le=_try_unpack_i32_le(payload),
+                payload=blob[off + 2 : off + fmt.record_len],
+                _views=views,
             )
         )
 
@@ -153,6 +183,42 @@ def parse_polyline(blob: bytes, fmt: PolylineFormat) -> tuple[bytes, list[Polyli
     return header, recs
 
 
+def polyline_columns(blob: bytes, fmt: PolylineFormat) -> tuple[np.ndarray, np.ndarray]:
+    """
+    parse_polyline と同じ分解を列単位（NumPy）で返す。レコードごとのオブジェクトは作らない。
+    戻り値: (rec_types: (N,) uint16, payloads: (N, record_len-2) uint8 / blob のビュー)
+    """
+    if fmt.header_len < 0 or fmt.record_len < 2:
+        raise ValueError("invalid format")
+
+    if len(blob) < fmt.header_len:
+        raise ValueError("blob shorter than header")
+
+    body_len = len(blob) - fmt.header_len
+    if (body_len % fmt.record_len) != 0:
+        raise ValueError("body not divisible by record_len")
+
+    nrec = body_len // fmt.record_len
+    arr = np.frombuffer(blob, dtype=np.uint8, offset=fmt.header_len, count=nrec * fmt.record_len)
+    arr = arr.reshape(nrec, fmt.record_len)
+    return arr[:, 0:2].view("<u2").ravel(), arr[:, 2:]
+
+
+def parse_polyline_typed(blob: bytes, fmt: PolylineFormat, keep_type: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    rec_type == keep_type のレコードだけを対象に、payload 先頭の f64(BE) x, y を取り出す。
+    他の種別のレコードは payload を一切デコードしない（--type 76 のような典型ケース用）。
+    戻り値: (idx: (M,) レコード番号, xy: (M, 2) float64)
+    """
+    if fmt.record_len < 2 + 16:
+        raise ValueError("record too short for f64 x, y")
+    rec_types, payloads = polyline_columns(blob, fmt)
+    idx = np.flatnonzero(rec_types == keep_type)
+    be = np.ascontiguousarray(payloads[idx, 0:16]).view(">f8")
+    xy = be.byteswap().view(be.dtype.newbyteorder()).reshape(-1, 2)
+    return idx, xy
+
+
 def guess_polyline_format(
     blob: bytes,
     candidate_headers: Iterable[int] = (0, 16, 32, 48, 64, 74, 80, 96),
@@ -175,24 +241,21 @@ def guess_polyline_format(
             if body_len <= 0 or (body_len % rlen) != 0:
                 continue
 
+            # 採点に使うのは u16 の種別列だけなので、レコードは組み立てずに列ビューで数える
             try:
-                _, recs = parse_polyline(blob, PolylineFormat(h, rlen))
-            except Exception:
+                types, _ = polyline_columns(blob, PolylineFormat(h, rlen))
+            except ValueError:
                 continue
 
-            if not recs:
+            n = types.size
+            if n == 0:
                 continue
 
-            types = [rec.rec_type_u16 for rec in recs]
-            small_ratio = sum(1 for t in types if t <= 1024) / len(types)
-            uniq = len(set(types))
-            uniq_ratio = uniq / len(types)
+            small_ratio = np.count_nonzero(types <= 1024) / n
+            uniq_ratio = np.unique(types).size / n
 
-            head_bias = 0.0
-            head = types[: min(10, len(types))]
-            if head:
-                most = max(head.count(x) for x in set(head))
-                head_bias = most / len(head)
+            head = types[: min(10, n)]
+            head_bias = int(np.bincount(head).max()) / head.size
 
             score = (small_ratio * 1.0) + ((1.0 - uniq_ratio) * 0.6) + (head_bias * 0.2)
 
@@ -204,22 +267,58 @@ def guess_polyline_format(
 
 
 def summarize_record_types(records: list[PolylineRecord]) -> dict[int, int]:
-    counts: dict[int, int] = {}
-    for r in records:
-        counts[r.rec_type_u16] = counts.get(r.rec_type_u16, 0) + 1
+    counts = Counter(r.rec_type_u16 for r in records)
     return dict(sorted(counts.items(), key=lambda kv: (-kv[1], kv[0])))
 
 
+def simplify_polyline_rdp(xs: Any, ys: Any, tol: float) -> np.ndarray:
+    """
+    Douglas–Peucker で折れ線を間引き、残す点の index（昇順）を返す。
+    tol は元データと同じ単位の許容距離。端点は必ず残す。
+    """
+    pts = np.column_stack([np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)])
+    n = len(pts)
+    if n <= 2 or tol <= 0:
+        return np.arange(n)
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j <= i + 1:
+            continue
+        a, b = pts[i], pts[j]
+        seg = b - a
+        rel = pts[i + 1 : j] - a
+        seg_len = float(np.hypot(seg[0], seg[1]))
+        if seg_len == 0.0:
+            d = np.hypot(rel[:, 0], rel[:, 1])
+        else:
+            d = np.abs(seg[0] * rel[:, 1] - seg[1] * rel[:, 0]) / seg_len
+        k = int(np.argmax(d))
+        if d[k] > tol:
+            m = i + 1 + k
+            keep[m] = True
+            stack.append((i, m))
+            stack.append((m, j))
+    return np.flatnonzero(keep)
+
+
+# hexdump の ASCII 欄用：表示可能文字 (0x20..0x7e) 以外を '.' に置き換える変換表
+_HEXDUMP_ASCII = bytes(c if 32 <= c <= 126 else 0x2E for c in range(256))
+
+
 def hexdump(data: bytes, width: int = 16, max_bytes: int = 512) -> str:
     """
     先頭 max_bytes だけの簡易hexdump（観測用）。
     """
-    b = data[:max_bytes]
+    b = bytes(data[:max_bytes])
     lines = []
     for i in range(0, len(b), width):
         chunk = b[i : i + width]
-        hexs = " ".join(f"{x:02x}" for x in chunk)
-        ascii_ = "".join(chr(x) if 32 <= x <= 126 else "." for x in chunk)
+        hexs = chunk.hex(" ")
+        ascii_ = chunk.translate(_HEXDUMP_ASCII).decode("latin-1")
         lines.append(f"{i:08x}  {hexs:<{width*3}}  {ascii_}")
     if len(data) > max_bytes:
         lines.append(f"... ({len(data)} bytes total)")
@@ -1,15 +1,21 @@
 #src\hypermill_nctools_inventory_exporter\nctool_plot.py
 from __future__ import annotations
 
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
+from functools import partial
+import os
 from pathlib import Path
 import sqlite3
+from typing import Any
 
+import numpy as np
+
+from hypermill_nctools_inventory_exporter.db import connect_readonly
 from hypermill_nctools_inventory_exporter.geometry_polyline import (
     PolylineFormat,
     guess_polyline_format,
-    parse_polyline,
-    read_geometry_polyline_blob,
+    polyline_columns,
 )
 
 # ---- 小さめユーティリティ ----
@@ -22,18 +28,9 @@ class ToolSimple:
     length: float
 
 
-def _safe_max_pos(*vals: float) -> float:
-    cands = []
-    for v in vals:
-        if v is None:
-            continue
-        try:
-            fv = float(v)
-        except Exception:
-            continue
-        if fv > 0:
-            cands.append(fv)
-    return max(cands) if cands else 0.0
+def _safe_max_pos(*vals: float | None) -> float:
+    # 数値への変換は呼び出し側で済ませておく（ここでは None と 0 以下を除くだけ）
+    return max((v for v in vals if v is not None and v > 0), default=0.0)
 
 
 def load_tool_simple(cur: sqlite3.Cursor, tool_id: int) -> ToolSimple | None:
@@ -51,10 +48,14 @@ def load_tool_simple(cur: sqlite3.Cursor, tool_id: int) -> ToolSimple | None:
         return None
 
     (_id, name, total_len, p1, p2, p3, p4, p5, p6) = row
+    return _tool_simple_from_columns(_id, name, total_len, p1, p2, p4)
+
+
+def _tool_simple_from_columns(_id, name, total_len, p1, p2, p4) -> ToolSimple:
     length = float(total_len or 0.0)
 
     # 直径は “それっぽい候補から最大の正値”
-    dia = _safe_max_pos(p4 or 0.0, p1 or 0.0, p2 or 0.0)
+    dia = _safe_max_pos(float(p4 or 0.0), float(p1 or 0.0), float(p2 or 0.0))
 
     return ToolSimple(tool_id=int(_id), name=str(name or ""), dia=dia, length=length)
 
@@ -73,70 +74,244 @@ def tool_cylinder_profile(tool: ToolSimple, tip_z: float) -> list[tuple[float, f
     return [(z0, 0.0), (z0, r), (z1, r), (z1, 0.0)]
 
 
-def mirror_profile(profile_zr: list[tuple[float, float]]) -> tuple[list[float], list[float]]:
+def mirror_profile(profile_zr: list[tuple[float, float]]) -> tuple[np.ndarray, np.ndarray]:
     # profile_zr: [(Z, R), ...]   R>=0
-    zs = [p[0] for p in profile_zr]
-    rs = [p[1] for p in profile_zr]
+    arr = np.asarray(profile_zr, dtype=np.float64).reshape(-1, 2)
     # 右側 + 左側（反転）で閉じる
-    z2 = zs + zs[::-1]
-    r2 = rs + [-v for v in rs[::-1]]
+    z2 = np.concatenate([arr[:, 0], arr[::-1, 0]])
+    r2 = np.concatenate([arr[:, 1], -arr[::-1, 1]])
     return z2, r2
 
 
-def _extract_points_f64_be_xyz(recs, only_type: int | None, stop_at_zero: bool, max_points: int | None):
-    pts: list[tuple[float, float, float]] = []
-    for r in recs:
-        if only_type is not None and getattr(r, "rec_type_u16", None) != only_type:
-            continue
-        f64_be = getattr(r, "f64_be", None)
-        if not f64_be or len(f64_be) < 2:
-            continue
-
-        x = float(f64_be[0])
-        y = float(f64_be[1])
-        z = float(f64_be[2]) if len(f64_be) >= 3 else 0.0
-
-        if stop_at_zero and x == 0.0 and y == 0.0 and z == 0.0:
-            break
-
-        pts.append((x, y, z))
-        if max_points is not None and len(pts) >= max_points:
-            break
+def _extract_points_f64_be_xyz(
+    blob: bytes,
+    fmt: PolylineFormat,
+    only_type: int | None,
+    stop_at_zero: bool,
+    max_points: int | None,
+) -> np.ndarray:
+    """
+    polyline BLOB の各レコード payload 先頭にある f64(BE) x, y, z を (N, 3) float64 で返す。
+    レコードごとのオブジェクトは作らず、構造化 dtype で全レコードを一括で読む。
+    payload に f64 が2個しかなければ z=0、2個未満なら空。形式が合わない場合は ValueError。
+    """
+    rec_types, _ = polyline_columns(blob, fmt)  # header/record_len の整合チェックも兼ねる
+    n_f64 = min((fmt.record_len - 2) // 8, 3)
+    if n_f64 < 2 or rec_types.size == 0:
+        return np.empty((0, 3), dtype=np.float64)
+
+    rec_dtype = np.dtype(
+        {
+            "names": ["type", "v"],
+            "formats": ["<u2", (">f8", (n_f64,))],
+            "offsets": [0, 2],
+            "itemsize": fmt.record_len,
+        }
+    )
+    recs = np.frombuffer(blob, dtype=rec_dtype, offset=fmt.header_len, count=rec_types.size)
+    vals = recs["v"] if only_type is None else recs["v"][recs["type"] == only_type]
+
+    pts = np.zeros((len(vals), 3), dtype=np.float64)
+    pts[:, :n_f64] = vals  # ここでネイティブのバイト順に変換される
+
+    if stop_at_zero:
+        is_zero = ~pts.any(axis=1)
+        if is_zero.any():
+            pts = pts[: int(np.argmax(is_zero))]
+    if max_points is not None:
+        pts = pts[:max_points]
     return pts
 
 
 def _polyline_to_section_RZ(
-    pts_xyz: list[tuple[float, float, float]],
+    pts_xyz: np.ndarray,
     *,
-    only_type: int | None,
-    stop_at_zero: bool,
-    max_points: int | None,
     swap_rz: bool,
     flip_r: bool,
     flip_z: bool,
-) -> tuple[list[float], list[float]]:
+) -> tuple[np.ndarray, np.ndarray]:
     # 今回のデータは概ね z=0 で、(R=x, Z=y) と解釈
-    zs: list[float] = []
-    rs: list[float] = []
-    for (x, y, _z) in pts_xyz:
-        Z = float(y)
-        R = float(x)
-
-        if swap_rz:
-            Z, R = R, Z
-        if flip_r:
-            R = -R
-        if flip_z:
-            Z = -Z
-
-        zs.append(Z)
-        rs.append(R)
+    # pts_xyz: (N, 3)。種別の絞り込みや 0 終端の打ち切りは _extract_points_f64_be_xyz 側で済んでいる
+    xs = pts_xyz[:, 0]
+    ys = pts_xyz[:, 1]
+    zs, rs = (xs, ys) if swap_rz else (ys, xs)
+    if flip_r:
+        rs = -rs
+    if flip_z:
+        zs = -zs
     return zs, rs
 
 
+_INVALID_TABLE = str.maketrans({c: "_" for c in '<>:"/\\|?*'})
+
+
 def sanitize_filename(s: str) -> str:
-    s = s.replace("\\", "__")
-    return "".join("_" if c in r'<>:"/\\|?*' else c for c in s)
+    return s.replace("\\", "__").translate(_INVALID_TABLE)
+
+
+@dataclass(frozen=True)
+class _Section:
+    """
+    1つの holder geometry から作った断面（同じ geometry を使う NCTool 間で使い回す）。
+    """
+    fmt: PolylineFormat
+    zs: np.ndarray
+    rs: np.ndarray
+    closed_r: np.ndarray  # 右側 + 左側（ミラー）を閉じたポリゴン
+    closed_z: np.ndarray
+
+
+def _section_from_blob(
+    blob: Any,
+    fmt: PolylineFormat | None,
+    guess_fallback: bool,
+    poly_rec_type: int | None,
+) -> _Section | None:
+    """
+    polyline BLOB から断面を作る。読めない geometry は None。
+    fmt は呼び出し側で決めた polyline 形式。None、または guess_fallback=True で
+    この blob に合わない場合だけ、blob ごとに推定し直す。
+    """
+    # NULL / BLOB 以外はスキップ
+    if not isinstance(blob, bytes):
+        return None
+
+    if fmt is None or (
+        guess_fallback
+        and (len(blob) < fmt.header_len or (len(blob) - fmt.header_len) % fmt.record_len != 0)
+    ):
+        fmt = guess_polyline_format(blob)
+
+    if fmt is None:
+        # このgeometryはスキップ
+        return None
+
+    try:
+        pts_xyz = _extract_points_f64_be_xyz(blob, fmt, only_type=poly_rec_type, stop_at_zero=True, max_points=None)
+    except ValueError:
+        return None
+    if len(pts_xyz) == 0:
+        return None
+
+    zs, rs = _polyline_to_section_RZ(
+        pts_xyz,
+        swap_rz=False,
+        flip_r=False,
+        flip_z=False,
+    )
+    return _Section(
+        fmt=fmt,
+        zs=zs,
+        rs=rs,
+        closed_r=np.concatenate([rs, -rs[::-1]]),
+        closed_z=np.concatenate([zs, zs[::-1]]),
+    )
+
+
+def _render_one(
+    row: tuple,
+    ax: Any,
+    sections: dict[int, _Section | None],
+    *,
+    out_dir: Path,
+    fmt: PolylineFormat | None,
+    guess_fallback: bool,
+    poly_rec_type: int | None,
+    tool_tip_mode: str,
+    annotate: bool,
+) -> bool:
+    """
+    NCTools 1行分（Tools / Geometries.polyline を LEFT JOIN 済み）の断面PNGを保存する。スキップした場合は False。
+    ax は呼び出し側で作ったものを使い回す（描画前に clear する）。
+    sections は geometry_id -> 断面のキャッシュ。同じ holder geometry は2回目以降 BLOB を解析しない。
+    """
+    from matplotlib.colors import to_rgba
+
+    (nctool_id, tool_id, geometry_id, gage_len, holder_reach, tool_len_nc,
+     t_id, t_name, t_total_len, t_p1, t_p2, t_p4, blob) = row
+    geometry_id = int(geometry_id)
+
+    # ---- polyline → 断面（geometry_id ごとに1回だけ）----
+    if geometry_id in sections:
+        section = sections[geometry_id]
+    else:
+        section = sections[geometry_id] = _section_from_blob(blob, fmt, guess_fallback, poly_rec_type)
+    if section is None:
+        return False
+
+    fmt = section.fmt
+    zs, rs = section.zs, section.rs
+    zmin, zmax = float(zs.min()), float(zs.max())
+
+    # ---- プロット（ホルダー：右側+左側のミラーで塗りつぶし）----
+    ax.clear()
+
+    # 右側（元データ）+ 左側（ミラー）を閉じた1つのポリゴンにして、輪郭線と塗りを1回で描く
+    ax.fill(section.closed_r, section.closed_z, facecolor=to_rgba("C0", 0.20), edgecolor="C0")
+
+    # 中心線
+    ax.axvline(0.0)
+
+    ax.set_title(f"nctool_id={nctool_id}  geom={geometry_id}  (header={fmt.header_len}, record={fmt.record_len}, type={poly_rec_type})")
+    ax.set_xlabel("R")
+    ax.set_ylabel("Z")
+    ax.grid(True)
+    ax.axis("equal")
+
+    if annotate:
+        # 点番号と一緒に元データの点位置も出す
+        ax.plot(rs, zs, marker="o", linestyle="none", color="C0")
+        for i, (r, z) in enumerate(zip(rs, zs)):
+            ax.text(r, z, str(i), fontsize=8)
+
+    # ---- 工具オーバーレイ（簡易シリンダ）----
+    tool = _tool_simple_from_columns(t_id, t_name, t_total_len, t_p1, t_p2, t_p4) if t_id is not None else None
+    if tool and tool.dia > 0 and tool.length > 0:
+        if tool_tip_mode == "zero":
+            tip_z = 0.0
+        elif tool_tip_mode == "zmax":
+            tip_z = float(zmax)
+        elif tool_tip_mode == "zmin":
+            tip_z = float(zmin)
+        else:  # "gage"
+            tip_z = float(gage_len or 0.0)
+
+        prof = tool_cylinder_profile(tool, tip_z=tip_z)
+        z_poly, r_poly = mirror_profile(prof)
+        ax.fill(r_poly, z_poly, alpha=0.30)
+
+    # ---- ファイル名 ----
+    d_txt = f"{tool.dia:g}" if tool else "0"
+    l_txt = f"{tool.length:g}" if tool else "0"
+    fname = f"nctool{nctool_id}_tool{tool_id}_D{d_txt}_L{l_txt}_geom{geometry_id}.png"
+    fname = sanitize_filename(fname)
+    save_path = out_dir / fname
+
+    # PNG の zlib 圧縮レベルを既定(6)から 3 に下げる。ファイルは3割ほど大きくなるがエンコードが速い
+    ax.figure.savefig(save_path, dpi=160, pil_kwargs={"compress_level": 3, "optimize": False})
+    return True
+
+
+# ---- 並列実行（ProcessPoolExecutor）用：ワーカープロセスごとに Figure と断面キャッシュを1つずつ持つ ----
+# 行に polyline まで含めて渡すので、ワーカーは DB に接続しない
+
+_WORKER_AX: Any = None
+_WORKER_SECTIONS: dict[int, _Section | None] = {}
+
+
+def _worker_init() -> None:
+    global _WORKER_AX
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    _, _WORKER_AX = plt.subplots()
+
+
+def _render_one_in_worker(row: tuple, **kwargs) -> bool:
+    assert _WORKER_AX is not None
+    return _render_one(row, _WORKER_AX, _WORKER_SECTIONS, **kwargs)
 
 
 def export_nctool_pngs_for_folder_id(
@@ -149,120 +324,73 @@ def export_nctool_pngs_for_folder_id(
     poly_rec_type: int | None = 76,
     tool_tip_mode: str = "zero",  # "zero" | "zmax" | "zmin" | "gage"
     annotate: bool = False,
+    max_workers: int | None = 1,
 ) -> tuple[int, int]:
     """
     指定folder_id配下のNCToolsを列挙して、holder_geometry_idの断面をPNG保存する。
+    既定（max_workers=1）ではこのプロセス内で順に処理する。
+    max_workers に 2 以上（None なら CPU 数）を渡すとプロセスプールで並列に描画する（明示的に選んだときだけ）。
+    その場合、呼び出し側のエントリポイントは `if __name__ == "__main__":` で守り、
+    PyInstaller で固めた exe では multiprocessing.freeze_support() を先頭で呼ぶこと（Windows は spawn のため）。
     戻り値: (n_ok, n_total)
     """
-    import matplotlib.pyplot as plt
-
     out_dir.mkdir(parents=True, exist_ok=True)
 
-    conn = sqlite3.connect(str(db_path))
-    cur = conn.cursor()
-
-    cur.execute(
-        """
-        SELECT id, tool_id, holder_geometry_id, gage_length, holder_reach, tool_length
-        FROM NCTools
-        WHERE folder_id = ?
-          AND holder_geometry_id IS NOT NULL
-        ORDER BY id
-        """,
-        (folder_id,),
-    )
-    rows = cur.fetchall()
+    # 読むだけなので読み取り専用＋mmap/キャッシュ調整済みの接続を使う
+    # Tools と Geometries.polyline も同じ文で取り、描画ループ中は SQL を発行しない
+    conn = connect_readonly(db_path)
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT nt.id, nt.tool_id, nt.holder_geometry_id, nt.gage_length, nt.holder_reach, nt.tool_length,
+                   t.id, t.name, t.total_length, t.dbl_param1, t.dbl_param2, t.dbl_param4,
+                   g.polyline
+            FROM NCTools nt
+            LEFT JOIN Tools t ON t.id = nt.tool_id
+            LEFT JOIN Geometries g ON g.id = nt.holder_geometry_id
+            WHERE nt.folder_id = ?
+              AND nt.holder_geometry_id IS NOT NULL
+            ORDER BY nt.id
+            """,
+            (folder_id,),
+        )
+        rows = cur.fetchall()
+    finally:
+        conn.close()
     n_total = len(rows)
-    n_ok = 0
-
-    for (nctool_id, tool_id, geometry_id, gage_len, holder_reach, tool_len_nc) in rows:
-        geometry_id = int(geometry_id)
-
-        # ---- polyline 読み取り ----
-        blob = read_geometry_polyline_blob(db_path, geometry_id)
 
-        if poly_header is not None and poly_record_len is not None:
-            fmt = PolylineFormat(int(poly_header), int(poly_record_len))
-        else:
-            fmt = guess_polyline_format(blob)
-
-        if fmt is None:
-            # このgeometryはスキップ
-            continue
-
-        try:
-            _, recs = parse_polyline(blob, fmt)
-        except Exception:
-            continue
-
-        pts_xyz = _extract_points_f64_be_xyz(recs, only_type=poly_rec_type, stop_at_zero=True, max_points=None)
-        if not pts_xyz:
-            continue
-
-        zs, rs = _polyline_to_section_RZ(
-            pts_xyz,
-            only_type=poly_rec_type,
-            stop_at_zero=True,
-            max_points=None,
-            swap_rz=False,
-            flip_r=False,
-            flip_z=False,
-        )
+    # polyline 形式は行ごとに決めず、ここで1回だけ決める
+    # 指定が無い場合は先頭の geometry で推定し、それに合わない blob だけ個別に推定する
+    if poly_header is not None and poly_record_len is not None:
+        fmt = PolylineFormat(int(poly_header), int(poly_record_len))
+    elif rows and isinstance(rows[0][-1], bytes):
+        fmt = guess_polyline_format(rows[0][-1])
+    else:
+        fmt = None
+
+    opts = dict(
+        out_dir=out_dir,
+        fmt=fmt,
+        guess_fallback=poly_header is None or poly_record_len is None,
+        poly_rec_type=poly_rec_type,
+        tool_tip_mode=tool_tip_mode,
+        annotate=annotate,
+    )
 
-        zmin, zmax = min(zs), max(zs)
+    workers = min(max_workers or os.cpu_count() or 1, n_total)
+    if workers <= 1:
+        import matplotlib.pyplot as plt
 
-        # ---- プロット（ホルダー：右側+左側のミラーで塗りつぶし）----
+        # Figure は1枚だけ作って全NCToolで使い回す
         fig, ax = plt.subplots()
-
-        # 右側（元データ）
-        ax.plot(rs, zs, marker="o")
-
-        # 左側（ミラー）
-        rs_m = [-r for r in rs]
-        ax.plot(rs_m, zs)
-
-        # ミラー+fill（簡易：R範囲の外形っぽく）
-        ax.fill(rs + rs_m[::-1], zs + zs[::-1], alpha=0.20)
-
-        # 中心線
-        ax.axvline(0.0)
-
-        ax.set_title(f"nctool_id={nctool_id}  geom={geometry_id}  (header={fmt.header_len}, record={fmt.record_len}, type={poly_rec_type})")
-        ax.set_xlabel("R")
-        ax.set_ylabel("Z")
-        ax.grid(True)
-        ax.axis("equal")
-
-        if annotate:
-            for i, (r, z) in enumerate(zip(rs, zs)):
-                ax.text(r, z, str(i), fontsize=8)
-
-        # ---- 工具オーバーレイ（簡易シリンダ）----
-        tool = load_tool_simple(cur, int(tool_id))
-        if tool and tool.dia > 0 and tool.length > 0:
-            if tool_tip_mode == "zero":
-                tip_z = 0.0
-            elif tool_tip_mode == "zmax":
-                tip_z = float(zmax)
-            elif tool_tip_mode == "zmin":
-                tip_z = float(zmin)
-            else:  # "gage"
-                tip_z = float(gage_len or 0.0)
-
-            prof = tool_cylinder_profile(tool, tip_z=tip_z)
-            z_poly, r_poly = mirror_profile(prof)
-            ax.fill(r_poly, z_poly, alpha=0.30)
-
-        # ---- ファイル名 ----
-        d_txt = f"{tool.dia:g}" if tool else "0"
-        l_txt = f"{tool.length:g}" if tool else "0"
-        fname = f"nctool{nctool_id}_tool{tool_id}_D{d_txt}_L{l_txt}_geom{geometry_id}.png"
-        fname = sanitize_filename(fname)
-        save_path = out_dir / fname
-
-        fig.savefig(save_path, dpi=160)
-        plt.close(fig)
-        n_ok += 1
-
-    conn.close()
+        try:
+            sections: dict[int, _Section | None] = {}
+            n_ok = sum(_render_one(row, ax, sections, **opts) for row in rows)
+        finally:
+            plt.close(fig)
+        return n_ok, n_total
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_worker_init) as ex:
+        n_ok = sum(ex.map(partial(_render_one_in_worker, **opts), rows, chunksize=4))
     return n_ok, n_total
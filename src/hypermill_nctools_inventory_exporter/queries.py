@@ -1,85 +1,109 @@
 # src/hypermill_nctools_inventory_exporter/queries.py
 
+# 指定フォルダの NCTools 一覧。パラメータ: :path（出力用のフォルダパス）, :folder_id
+# ext_reach_sum は行ごとの相関サブクエリではなく、フォルダ内の Components を1回だけ集計して結合する
 NCTOOLS_FOR_FOLDER_SQL_TEMPLATE = r"""
 SELECT
-  ? AS nctools_folder_path,
+  :path AS nctools_folder_path,
   nt.nc_number_val AS nc_number,
   nt.nc_name       AS nc_name,
   nt.comment       AS nc_comment,
   t.name           AS tool_name,
   h.name           AS holder_name,
-  (
-    SELECT GROUP_CONCAT(x.ext, ' / ')
-    FROM (
-      SELECT printf('%d:%s(%.3f)', c.position, e.name, c.{reach_col}) AS ext
-      FROM Components c
-      JOIN Extensions e ON e.extension_id = c.extension_id
-      WHERE c.nctool_id = nt.id
-      ORDER BY c.position
-    ) x
-  ) AS extensions,
+  NULL             AS extensions,  -- NCTOOLS_FOR_FOLDER_EXT_SQL_TEMPLATE の結果を Python 側で連結して埋める
   nt.gage_length   AS gage_length,
   nt.tool_length   AS tool_length,
-  COALESCE((
-    SELECT SUM(c.{reach_col})
-    FROM Components c
-    WHERE c.nctool_id = nt.id
-  ), 0) AS ext_reach_sum,
-  (nt.tool_length + COALESCE((
-    SELECT SUM(c.{reach_col}) FROM Components c WHERE c.nctool_id = nt.id
-  ), 0)) AS overhang_est,
+  COALESCE(ca.ext_reach_sum, 0) AS ext_reach_sum,
+  (nt.tool_length + COALESCE(ca.ext_reach_sum, 0)) AS overhang_est,
   nt.id            AS nctool_id
 FROM NCTools nt
 LEFT JOIN Tools   t ON t.id = nt.tool_id
 LEFT JOIN Holders h ON h.id = nt.holder_id
-WHERE nt.folder_id = ?
+LEFT JOIN (
+  SELECT c.nctool_id, SUM(c.{reach_col}) AS ext_reach_sum
+  FROM Components c
+  WHERE c.nctool_id IN (SELECT id FROM NCTools WHERE folder_id = :folder_id)
+  GROUP BY c.nctool_id
+) ca ON ca.nctool_id = nt.id
+WHERE nt.folder_id = :folder_id
 ORDER BY nt.nc_number_val
 """
 
-NCTOOLS_ALL_FAST_SQL_TEMPLATE = r"""
-WITH
+# 指定フォルダの NCTools の延長構成（1行 = 1 Component、nctool_id, position 順）
+NCTOOLS_FOR_FOLDER_EXT_SQL_TEMPLATE = r"""
+SELECT
+  c.nctool_id AS nctool_id,
+  printf('%d:%s(%.3f)', c.position, e.name, c.{reach_col}) AS ext
+FROM Components c
+JOIN Extensions e ON e.extension_id = c.extension_id
+WHERE c.nctool_id IN (SELECT id FROM NCTools WHERE folder_id = ?)
+ORDER BY c.nctool_id, c.position
+"""
+
+# NCTOOLS_ALL_FAST_SQL が参照する TEMP テーブルを作るスクリプト（export._build_all_nctools_temp_tables から実行）
+# フォルダツリーの再帰 CTE と Components の集計を1回だけ実体化し、folder_id / nctool_id に索引を張る
+NCTOOLS_FOLDER_TREE_TEMP_SQL = r"""
+DROP TABLE IF EXISTS temp.nctools_folder_tree;
+CREATE TEMP TABLE nctools_folder_tree AS
+WITH RECURSIVE
 root AS (
   SELECT folder_id AS root_id
   FROM Folders
   WHERE name = 'NCTools'
   LIMIT 1
 ),
-folder_tree(folder_id, parent_id, name, path) AS (
-  SELECT f.folder_id, f.parent_id, f.name, f.name AS path
+folder_tree(folder_id, path) AS (
+  SELECT f.folder_id, f.name
   FROM Folders f, root
   WHERE f.parent_id = root.root_id
 
   UNION ALL
 
-  SELECT c.folder_id, c.parent_id, c.name, folder_tree.path || '\' || c.name
+  SELECT c.folder_id, folder_tree.path || '\' || c.name
   FROM Folders c
   JOIN folder_tree ON c.parent_id = folder_tree.folder_id
-),
-comp_sorted AS (
+)
+SELECT folder_id, path FROM folder_tree;
+CREATE INDEX temp.ix_nctools_folder_tree ON nctools_folder_tree(folder_id);
+"""
+
+# 延長構成の集計（SQLite 3.44+）：GROUP_CONCAT 自体に ORDER BY position を付け、並べ替え済みサブクエリを挟まない
+NCTOOLS_COMP_AGG_TEMP_SQL_TEMPLATE = r"""
+DROP TABLE IF EXISTS temp.nctools_comp_agg;
+CREATE TEMP TABLE nctools_comp_agg AS
+SELECT
+  c.nctool_id,
+  SUM(c.{reach_col}) AS ext_reach_sum,
+  GROUP_CONCAT(printf('%d:%s(%.3f)', c.position, e.name, c.{reach_col}), ' / ' ORDER BY c.position) AS extensions
+FROM Components c
+JOIN Extensions e ON e.extension_id = c.extension_id
+GROUP BY c.nctool_id;
+CREATE INDEX temp.ix_nctools_comp_agg ON nctools_comp_agg(nctool_id);
+"""
+
+# 同上（3.44 未満用）：集計関数に ORDER BY が書けないので、nctool_id, position 順のサブクエリから連結する
+NCTOOLS_COMP_AGG_TEMP_LEGACY_SQL_TEMPLATE = r"""
+DROP TABLE IF EXISTS temp.nctools_comp_agg;
+CREATE TEMP TABLE nctools_comp_agg AS
+SELECT
+  nctool_id,
+  SUM(reach_val) AS ext_reach_sum,
+  GROUP_CONCAT(ext_str, ' / ') AS extensions
+FROM (
   SELECT
     c.nctool_id,
-    c.position,
-    e.name AS ext_name,
-    c.{reach_col} AS reach_val
+    c.{reach_col} AS reach_val,
+    printf('%d:%s(%.3f)', c.position, e.name, c.{reach_col}) AS ext_str
   FROM Components c
   JOIN Extensions e ON e.extension_id = c.extension_id
-),
-comp_agg AS (
-  SELECT
-    nctool_id,
-    SUM(reach_val) AS ext_reach_sum,
-    GROUP_CONCAT(ext_str, ' / ') AS extensions
-  FROM (
-    SELECT
-      nctool_id,
-      position,
-      reach_val,  -- ★ これを追加（外側SUM用）
-      printf('%d:%s(%.3f)', position, ext_name, reach_val) AS ext_str
-    FROM comp_sorted
-    ORDER BY nctool_id, position
-  )
-  GROUP BY nctool_id
+  ORDER BY c.nctool_id, c.position
 )
+GROUP BY nctool_id;
+CREATE INDEX temp.ix_nctools_comp_agg ON nctools_comp_agg(nctool_id);
+"""
+
+# 全NCツール一覧。先に export._build_all_nctools_temp_tables で TEMP テーブルを作っておくこと
+NCTOOLS_ALL_FAST_SQL = r"""
 SELECT
   ft.path           AS nctools_folder_path,
   nt.nc_number_val  AS nc_number,
@@ -94,9 +118,9 @@ SELECT
   (nt.tool_length + COALESCE(ca.ext_reach_sum, 0)) AS overhang_est,
   nt.id             AS nctool_id
 FROM NCTools nt
-JOIN folder_tree ft ON ft.folder_id = nt.folder_id
+JOIN temp.nctools_folder_tree ft ON ft.folder_id = nt.folder_id
 LEFT JOIN Tools   t ON t.id = nt.tool_id
 LEFT JOIN Holders h ON h.id = nt.holder_id
-LEFT JOIN comp_agg ca ON ca.nctool_id = nt.id
+LEFT JOIN temp.nctools_comp_agg ca ON ca.nctool_id = nt.id
 ORDER BY ft.path, nt.nc_number_val
 """
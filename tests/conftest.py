@@ -0,0 +1,68 @@
+"""
+テスト用の小さな hyperMILL ツールDB（SQLite）を作るフィクスチャ。
+"""
+from __future__ import annotations
+
+import sqlite3
+import uuid
+from pathlib import Path
+
+import pytest
+
+_SCHEMA = """
+CREATE TABLE Folders(folder_id INTEGER PRIMARY KEY, parent_id INTEGER, name TEXT, obj_guid BLOB, comment TEXT);
+CREATE TABLE Tools(id INTEGER PRIMARY KEY, name TEXT, total_length REAL, dbl_param1 REAL, dbl_param2 REAL,
+                   dbl_param3 REAL, dbl_param4 REAL, dbl_param5 REAL, dbl_param6 REAL);
+CREATE TABLE Holders(id INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE Extensions(extension_id INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE Components(nctool_id INTEGER, extension_id INTEGER, position INTEGER, reach REAL);
+CREATE TABLE NCTools(id INTEGER PRIMARY KEY, folder_id INTEGER, tool_id INTEGER, holder_id INTEGER,
+                     holder_geometry_id INTEGER, nc_number_val INTEGER, nc_name TEXT, comment TEXT,
+                     gage_length REAL, holder_reach REAL, tool_length REAL, obj_guid BLOB);
+CREATE TABLE Geometries(id INTEGER PRIMARY KEY, polyline BLOB);
+"""
+
+
+def _build_tool_db(path: Path, tree: dict[str, list[str]]) -> Path:
+    """
+    tree = {NCTools直下のフォルダ名: [サブフォルダ名, ...]}。
+    各サブフォルダに NCツールを2本ずつ置き、1本目には延長を2段付ける。
+    """
+    conn = sqlite3.connect(path)
+    conn.executescript(_SCHEMA)
+    conn.execute("INSERT INTO Folders VALUES(1, NULL, 'Root', ?, NULL)", (uuid.uuid4().bytes_le,))
+    conn.execute("INSERT INTO Folders VALUES(2, 1, 'NCTools', ?, NULL)", (uuid.uuid4().bytes_le,))
+    conn.execute("INSERT INTO Tools VALUES(1, 'T1', 40.0, 6.0, 1.0, 0, 12.0, 0, 0)")
+    conn.execute("INSERT INTO Holders VALUES(1, 'H1')")
+    conn.execute("INSERT INTO Extensions VALUES(1, 'E1')")
+    conn.execute("INSERT INTO Extensions VALUES(2, 'E2')")
+
+    folder_id = 3
+    nctool_id = 1
+    for top, subs in tree.items():
+        top_id = folder_id
+        conn.execute("INSERT INTO Folders VALUES(?, 2, ?, ?, NULL)", (top_id, top, uuid.uuid4().bytes_le))
+        folder_id += 1
+        for sub in subs:
+            conn.execute("INSERT INTO Folders VALUES(?, ?, ?, ?, NULL)", (folder_id, top_id, sub, uuid.uuid4().bytes_le))
+            for k in range(2):
+                conn.execute(
+                    "INSERT INTO NCTools VALUES(?, ?, 1, 1, NULL, ?, ?, NULL, 50.0, 10.0, 20.0, ?)",
+                    (nctool_id, folder_id, 100 + k, f"N{nctool_id}", uuid.uuid4().bytes_le),
+                )
+                if k == 0:
+                    conn.execute("INSERT INTO Components VALUES(?, 2, 2, 7.5)", (nctool_id,))
+                    conn.execute("INSERT INTO Components VALUES(?, 1, 1, 5.0)", (nctool_id,))
+                nctool_id += 1
+            folder_id += 1
+    conn.commit()
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def make_tool_db(tmp_path):
+    def _make(tree: dict[str, list[str]], name: str = "tool.db") -> Path:
+        return _build_tool_db(tmp_path / name, tree)
+
+    return _make
@@ -0,0 +1,56 @@
+"""
+DB 接続まわりのテスト。
+"""
+import sqlite3
+
+import pytest
+
+from src.hypermill_nctools_inventory_exporter.db import connect_readonly, db_cache_key
+
+
+def test_connect_readonly_escapes_path(tmp_path):
+    # '#' や '%xx' を URI にそのまま埋めると、別のファイルを開くか開けない
+    d = tmp_path / "a #b %41c"
+    d.mkdir()
+    db = d / "tool #1.db"
+    conn = sqlite3.connect(db)
+    conn.execute("CREATE TABLE t(v INTEGER)")
+    conn.execute("INSERT INTO t VALUES(42)")
+    conn.commit()
+    conn.close()
+
+    conn = connect_readonly(db)
+    try:
+        assert conn.execute("SELECT v FROM t").fetchone() == (42,)
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("INSERT INTO t VALUES(1)")
+    finally:
+        conn.close()
+    assert sorted(p.name for p in d.iterdir()) == ["tool #1.db"]
+
+
+def test_db_cache_key_changes_on_wal_commit(tmp_path):
+    db = tmp_path / "tool.db"
+    writer = sqlite3.connect(db)
+    try:
+        writer.execute("PRAGMA journal_mode=WAL")
+        writer.execute("PRAGMA wal_autocheckpoint=0")
+        writer.execute("CREATE TABLE t(v INTEGER)")
+        writer.commit()
+        before = db_cache_key(db)
+        main_mtime = db.stat().st_mtime_ns
+
+        writer.execute("INSERT INTO t VALUES(1)")
+        writer.commit()
+
+        # コミットは -wal に入り、本体の mtime は変わらない
+        assert db.stat().st_mtime_ns == main_mtime
+        assert db_cache_key(db) != before
+    finally:
+        writer.close()
+
+
+def test_db_cache_key_without_wal(tmp_path):
+    db = tmp_path / "tool.db"
+    sqlite3.connect(db).close()
+    assert db_cache_key(db) == (str(db), db.stat().st_mtime_ns, 0, 0)
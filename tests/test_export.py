@@ -0,0 +1,190 @@
+"""
+Excel 出力まわりのテスト。
+"""
+import sqlite3
+import tempfile
+
+import pytest
+from openpyxl import load_workbook
+
+from src.hypermill_nctools_inventory_exporter.export import (
+    _build_all_nctools_temp_tables,
+    _dedupe_sheet_name,
+    _sanitize_sheet_name,
+    _sqlite_version,
+    _write_rows_xlsx,
+    export_all_nctools_to_excel_by_sheet,
+    export_all_nctools_to_excel_fast,
+    export_nc_tool_list_for_folder_path,
+)
+from src.hypermill_nctools_inventory_exporter.queries import (
+    NCTOOLS_COMP_AGG_TEMP_LEGACY_SQL_TEMPLATE,
+    NCTOOLS_COMP_AGG_TEMP_SQL_TEMPLATE,
+)
+
+
+def _sheet_rows(path):
+    wb = load_workbook(path, read_only=True)
+    return {ws.title: [list(r) for r in ws.iter_rows(values_only=True)] for ws in wb.worksheets}
+
+
+def test_sanitize_sheet_name():
+    assert _sanitize_sheet_name("DD0\\Sub[1]:a*b?/c") == "DD0_Sub_1__a_b__c"
+    assert _sanitize_sheet_name("'x'") == "x"
+    assert _sanitize_sheet_name("") == "Sheet"
+    assert len(_sanitize_sheet_name("A" * 40)) == 31
+
+
+def test_dedupe_sheet_name_keeps_31_chars():
+    used: set[str] = set()
+    long_name = "B" * 31
+    assert _dedupe_sheet_name(long_name, used) == long_name
+    second = _dedupe_sheet_name(long_name, used)
+    assert second == "B" * 28 + "_01"
+    assert len(second) == 31
+
+
+def test_dedupe_sheet_name_ignores_case():
+    used: set[str] = set()
+    assert _dedupe_sheet_name("Mill", used) == "Mill"
+    assert _dedupe_sheet_name("MILL", used) == "MILL_01"
+    assert _dedupe_sheet_name("mill", used) == "mill_02"
+
+
+def test_write_rows_xlsx_cleans_up_on_error(tmp_path, monkeypatch):
+    tmp = tmp_path / "tmp"
+    tmp.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp))
+
+    def rows():
+        yield [1, "a"]
+        raise ValueError("broken row")
+
+    with pytest.raises(ValueError):
+        _write_rows_xlsx(tmp_path / "out.xlsx", ["n", "s"], rows())
+    # constant_memory の一時ファイルが残らないこと
+    assert list(tmp.iterdir()) == []
+
+
+def test_by_sheet_export_with_case_only_path_difference(make_tool_db, tmp_path):
+    db = make_tool_db({"Mill": ["A"], "MILL": ["a"]})
+    out = tmp_path / "by_sheet.xlsx"
+
+    export_all_nctools_to_excel_by_sheet(db, out)
+
+    names = load_workbook(out, read_only=True).sheetnames
+    assert len(names) == 2
+    assert len({n.casefold() for n in names}) == 2
+
+
+def test_header_row_is_plain(make_tool_db, tmp_path):
+    db = make_tool_db({"Mill": ["A"]})
+    out = tmp_path / "fast.xlsx"
+
+    export_all_nctools_to_excel_fast(db, out)
+
+    cell = load_workbook(out)["Sheet1"]["A1"]
+    assert cell.value == "nctools_folder_path"
+    assert not cell.font.b
+    assert cell.border.left.style is None
+
+
+def test_by_sheet_export_matches_fast_export(make_tool_db, tmp_path):
+    db = make_tool_db({"DD0": ["Sub0", "Sub1"], "DD1": ["Sub0"]})
+    fast = tmp_path / "fast.xlsx"
+    by_sheet = tmp_path / "by_sheet.xlsx"
+
+    export_all_nctools_to_excel_fast(db, fast)
+    export_all_nctools_to_excel_by_sheet(db, by_sheet)
+
+    (fast_rows,) = _sheet_rows(fast).values()
+    header, body = fast_rows[0], fast_rows[1:]
+    sheets = _sheet_rows(by_sheet)
+
+    assert list(sheets) == ["DD0_Sub0", "DD0_Sub1", "DD1_Sub0"]
+    assert all(rows[0] == header for rows in sheets.values())
+    assert [r for rows in sheets.values() for r in rows[1:]] == body
+    assert len(body) == 6
+
+
+def test_folder_export_matches_fast_export(make_tool_db, tmp_path):
+    db = make_tool_db({"DD0": ["Sub0", "Sub1"]})
+    fast = tmp_path / "fast.xlsx"
+    one = tmp_path / "one.xlsx"
+
+    export_all_nctools_to_excel_fast(db, fast)
+    export_nc_tool_list_for_folder_path(db, "DD0\\Sub1", one)
+
+    (fast_rows,) = _sheet_rows(fast).values()
+    (one_rows,) = _sheet_rows(one).values()
+    assert one_rows[0] == fast_rows[0]
+    assert one_rows[1:] == [r for r in fast_rows[1:] if r[0] == "DD0\\Sub1"]
+
+
+def test_extensions_are_ordered_by_position(make_tool_db, tmp_path):
+    # フィクスチャは position 2 → 1 の順に Components を入れている
+    db = make_tool_db({"DD0": ["Sub0"]})
+    out = tmp_path / "fast.xlsx"
+
+    export_all_nctools_to_excel_fast(db, out)
+
+    (rows,) = _sheet_rows(out).values()
+    first = dict(zip(rows[0], rows[1]))
+    assert first["extensions（pos:name(reach)）"] == "1:E1(5.000) / 2:E2(7.500)"
+    assert first["reach_sum（延長）"] == 12.5
+    assert first["推定突き出し（tool_length+reach_sum）"] == 32.5
+
+
+def _comp_agg_rows(conn, template):
+    conn.executescript(template.format(reach_col="reach"))
+    return conn.execute("SELECT * FROM temp.nctools_comp_agg ORDER BY nctool_id").fetchall()
+
+
+def test_comp_agg_ordered_sql_matches_legacy(make_tool_db):
+    db = make_tool_db({"DD0": ["Sub0", "Sub1"]})
+    conn = sqlite3.connect(db)
+    try:
+        if _sqlite_version(conn) < (3, 44, 0):
+            pytest.skip("GROUP_CONCAT(... ORDER BY) は SQLite 3.44 以降")
+        legacy = _comp_agg_rows(conn, NCTOOLS_COMP_AGG_TEMP_LEGACY_SQL_TEMPLATE)
+        assert legacy == _comp_agg_rows(conn, NCTOOLS_COMP_AGG_TEMP_SQL_TEMPLATE)
+    finally:
+        conn.close()
+
+
+def test_temp_tables_can_be_rebuilt_on_one_connection(make_tool_db):
+    db = make_tool_db({"DD0": ["Sub0"]})
+    conn = sqlite3.connect(db)
+    try:
+        _build_all_nctools_temp_tables(conn, "reach")
+        _build_all_nctools_temp_tables(conn, "reach")
+        (n,) = conn.execute("SELECT COUNT(*) FROM temp.nctools_folder_tree").fetchone()
+        assert n == 2
+    finally:
+        conn.close()
+
+
+def test_folder_export_unknown_path(make_tool_db, tmp_path):
+    db = make_tool_db({"DD0": ["Sub0"]})
+    with pytest.raises(RuntimeError, match="指定パスが見つかりません"):
+        export_nc_tool_list_for_folder_path(db, "DD0\\Sub", tmp_path / "one.xlsx")
+
+
+def test_schema_cache_sees_wal_commits(make_tool_db, tmp_path):
+    db = make_tool_db({"DD0": ["Sub0"]})
+    writer = sqlite3.connect(db)
+    try:
+        writer.execute("PRAGMA journal_mode=WAL")
+        writer.execute("PRAGMA wal_autocheckpoint=0")
+        export_all_nctools_to_excel_fast(db, tmp_path / "before.xlsx")
+
+        # 本体ファイルに反映されないまま reach 列名が変わる
+        writer.execute("ALTER TABLE Components RENAME COLUMN reach TO reach_mm")
+        writer.commit()
+        export_all_nctools_to_excel_fast(db, tmp_path / "after.xlsx")
+    finally:
+        writer.close()
+
+    (before,) = _sheet_rows(tmp_path / "before.xlsx").values()
+    (after,) = _sheet_rows(tmp_path / "after.xlsx").values()
+    assert after == before
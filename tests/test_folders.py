@@ -0,0 +1,75 @@
+"""
+フォルダツリー取得まわりのテスト。
+"""
+import sqlite3
+import uuid
+
+import pytest
+
+from src.hypermill_nctools_inventory_exporter.folders import (
+    _UUID_VECTOR_MIN,
+    _uuid_from_blob,
+    _uuids_from_blobs,
+    get_nctools_folder_paths,
+    resolve_folder_id_by_nctools_path,
+)
+
+
+def test_uuid_from_blob_matches_uuid_module():
+    raw = uuid.uuid4().bytes_le
+    assert _uuid_from_blob(raw) == str(uuid.UUID(bytes_le=raw))
+    assert _uuid_from_blob(None) is None
+    assert _uuid_from_blob(raw[:15]) is None
+    assert _uuid_from_blob(str(uuid.uuid4())) is None
+
+
+@pytest.mark.parametrize("n", [_UUID_VECTOR_MIN - 1, _UUID_VECTOR_MIN, 300])
+def test_uuids_from_blobs_matches_scalar(n):
+    blobs = [uuid.uuid4().bytes_le for _ in range(n)]
+    # 16バイト bytes 以外が混ざっても位置を保って None になること
+    blobs[0] = None
+    blobs[5] = b"\x00" * 15
+    blobs[-1] = bytearray(16)
+
+    expected = [_uuid_from_blob(b) for b in blobs]
+    assert _uuids_from_blobs(blobs) == expected
+    assert expected[1] == str(uuid.UUID(bytes_le=blobs[1]))
+    assert expected[0] is None and expected[5] is None and expected[-1] is None
+
+
+def test_uuids_from_blobs_all_invalid():
+    assert _uuids_from_blobs([None] * _UUID_VECTOR_MIN) == [None] * _UUID_VECTOR_MIN
+
+
+def test_folder_paths_with_guid(make_tool_db):
+    db = make_tool_db({"DD0": ["Sub"]})
+
+    rows = get_nctools_folder_paths(db, with_guid=True)
+
+    assert [(r["path"], r["depth"]) for r in rows] == [("DD0", 1), ("DD0\\Sub", 2)]
+    assert all(str(uuid.UUID(r["obj_guid"])) == r["obj_guid"] for r in rows)
+
+
+def test_resolve_folder_id_by_nctools_path(make_tool_db):
+    # "DD" は "DD0" の接頭辞。区切りまで含めて比較しているので取り違えないこと
+    db = make_tool_db({"DD0": ["Sub", "Sub2"], "DD": ["Sub"]})
+    conn = sqlite3.connect(db)
+    try:
+        for r in get_nctools_folder_paths(db):
+            folder_id = resolve_folder_id_by_nctools_path(conn, r["path"])
+            (name, parent_id) = conn.execute(
+                "SELECT name, parent_id FROM Folders WHERE folder_id = ?", (folder_id,)
+            ).fetchone()
+            assert name == r["name"]
+            if r["depth"] == 2:
+                (parent_name,) = conn.execute(
+                    "SELECT name FROM Folders WHERE folder_id = ?", (parent_id,)
+                ).fetchone()
+                assert parent_name == r["path"].split("\\")[0]
+
+        with pytest.raises(RuntimeError):
+            resolve_folder_id_by_nctools_path(conn, "DD0\\Su")
+        with pytest.raises(RuntimeError):
+            resolve_folder_id_by_nctools_path(conn, "DD0\\Sub\\Missing")
+    finally:
+        conn.close()
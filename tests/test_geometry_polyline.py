@@ -0,0 +1,99 @@
+"""
+polyline 解析まわりのテスト。
+"""
+import sqlite3
+
+import numpy as np
+import pytest
+
+from src.hypermill_nctools_inventory_exporter.geometry_polyline import (
+    PolylineFormat,
+    iter_geometry_ids_with_polyline,
+    parse_polyline,
+    polyline_columns,
+    read_geometry_polyline_blob,
+    read_geometry_polyline_blobs,
+    simplify_polyline_rdp,
+)
+
+
+def test_read_polyline_blobs_from_path_with_hash(tmp_path):
+    d = tmp_path / "tools #2"
+    d.mkdir()
+    db = d / "tool.db"
+    conn = sqlite3.connect(db)
+    conn.execute("CREATE TABLE Geometries(id INTEGER PRIMARY KEY, polyline BLOB)")
+    conn.executemany("INSERT INTO Geometries VALUES(?, ?)", [(1, b"\x01\x02\x03"), (2, None), (3, b"\x04")])
+    conn.commit()
+    conn.close()
+
+    assert read_geometry_polyline_blob(db, 1) == b"\x01\x02\x03"
+    assert read_geometry_polyline_blob(db, 1, limit=2) == b"\x01\x02"
+    assert list(read_geometry_polyline_blobs(db, [3, 1, 2])) == [(1, b"\x01\x02\x03"), (3, b"\x04")]
+    assert iter_geometry_ids_with_polyline(db) == [1, 3]
+
+
+def test_simplify_drops_collinear_points():
+    xs = np.linspace(0.0, 10.0, 11)
+    ys = 2.0 * xs
+    assert simplify_polyline_rdp(xs, ys, 0.01).tolist() == [0, 10]
+
+
+def test_simplify_keeps_corner_and_endpoints():
+    # 0..5 で上り、5..10 で水平。角の index 5 だけが残る
+    xs = np.arange(11, dtype=np.float64)
+    ys = np.minimum(xs, 5.0)
+    assert simplify_polyline_rdp(xs, ys, 0.1).tolist() == [0, 5, 10]
+
+
+def test_simplify_error_stays_within_tolerance():
+    rng = np.random.default_rng(0)
+    xs = np.linspace(0.0, 50.0, 500)
+    ys = np.sin(xs / 5.0) * 10.0 + rng.normal(0.0, 0.05, xs.size)
+    tol = 0.2
+
+    keep = simplify_polyline_rdp(xs, ys, tol)
+
+    assert keep[0] == 0 and keep[-1] == xs.size - 1
+    assert np.all(np.diff(keep) > 0)
+    assert keep.size < xs.size
+    # 間引いた各点は、それを挟む残存点を結ぶ線分から tol 以内
+    for i, j in zip(keep[:-1], keep[1:]):
+        seg = np.array([xs[j] - xs[i], ys[j] - ys[i]])
+        rel = np.column_stack([xs[i + 1 : j] - xs[i], ys[i + 1 : j] - ys[i]])
+        d = np.abs(seg[0] * rel[:, 1] - seg[1] * rel[:, 0]) / np.hypot(*seg)
+        assert np.all(d <= tol)
+
+
+def test_simplify_without_tolerance_keeps_everything():
+    xs = [0.0, 1.0, 2.0, 3.0]
+    ys = [0.0, 0.0, 0.0, 0.0]
+    assert simplify_polyline_rdp(xs, ys, 0.0).tolist() == [0, 1, 2, 3]
+    assert simplify_polyline_rdp(xs[:2], ys[:2], 1.0).tolist() == [0, 1]
+
+
+@pytest.mark.parametrize("header_len, record_len", [(4, 2), (4, 3), (2, 8), (-1, 4), (4, 1), (4, 5)])
+def test_parse_polyline_and_columns_accept_the_same_formats(header_len, record_len):
+    blob = b"\x00" * 4 + bytes(range(12))
+    fmt = PolylineFormat(header_len, record_len)
+
+    def outcome(fn):
+        try:
+            fn(blob, fmt)
+        except ValueError as e:
+            return str(e)
+        return "ok"
+
+    assert outcome(parse_polyline) == outcome(polyline_columns)
+
+
+def test_parse_polyline_matches_columns():
+    blob = b"\xaa" * 3 + bytes(range(40))
+    fmt = PolylineFormat(3, 10)
+
+    header, recs = parse_polyline(blob, fmt)
+    rec_types, payloads = polyline_columns(blob, fmt)
+
+    assert header == b"\xaa" * 3
+    assert [r.rec_type_u16 for r in recs] == rec_types.tolist()
+    assert [r.payload for r in recs] == [bytes(p) for p in payloads]
@@ -0,0 +1,57 @@
+"""
+GUI のモジュールレベル関数（フォルダ検索・フォルダ一覧キャッシュ）のテスト。Tk が無い環境ではスキップする。
+"""
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("tkinter")
+pytest.importorskip("dotenv")
+
+
+@pytest.fixture(scope="module")
+def gui():
+    path = Path(__file__).resolve().parents[1] / "apps" / "gui.py"
+    spec = importlib.util.spec_from_file_location("_hypermill_gui", path)
+    module = importlib.util.module_from_spec(spec)
+    # dataclass の解決に sys.modules への登録が要る
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_ngram_candidates_cover_substring_matches(gui):
+    paths = ["dd0600\\sub_a", "dd0601\\sub_b", "mill\\dd06", "drill\\xyz", "ab"]
+    index = gui._build_ngram_index(paths)
+
+    for key in ["dd06", "sub", "\\su", "ill", "xyz", "dd0600\\sub_a", "zzz"]:
+        candidates = gui._ngram_candidates(index, key)
+        # 候補は部分一致をすべて含み、昇順
+        assert {i for i, p in enumerate(paths) if key in p} <= set(candidates)
+        assert candidates == sorted(candidates)
+
+
+def test_ngram_candidates_exact_for_unique_gram(gui):
+    index = gui._build_ngram_index(["abcx", "xbcd", "abd"])
+    assert gui._ngram_candidates(index, "abc") == [0]
+    assert gui._ngram_candidates(index, "bcd") == [1]
+    assert gui._ngram_candidates(index, "qqq") == []
+
+
+def test_background_load_leaves_cache_to_tk_thread(gui, make_tool_db, monkeypatch):
+    monkeypatch.setattr(gui, "_FOLDER_CACHE", {})
+    db = make_tool_db({"DD0": ["Sub"]})
+
+    # 別スレッド用の読込はキャッシュに書かない
+    key = gui._folder_cache_key(db)
+    loaded = gui._load_folders(db)
+    assert loaded[1] == ["DD0", "DD0\\Sub"]
+    assert gui._FOLDER_CACHE == {}
+
+    # Tk スレッド側で登録すると、同じ DB の古いキーは置き換わる
+    gui._store_folder_cache((key[0], key[1] - 1, *key[2:]), loaded)
+    gui._store_folder_cache(key, loaded)
+    assert list(gui._FOLDER_CACHE) == [key]
+    assert gui._load_folders_cached(db) is loaded